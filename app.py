@@ -1,5 +1,4 @@
 import os
-import io
 import time
 import pathlib
 import pandas as pd
@@ -8,7 +7,15 @@ from dotenv import load_dotenv
 
 from utils.preprocess import clean_dataframe
 from utils.categorize import HybridCategorizer, ALLOWED_CATEGORIES
-from utils.visualize import plot_category_bar, plot_category_pie
+from utils.exemplar_index import EXEMPLAR_INDEX_PATH, ExemplarIndex
+from utils.export import EXPORT_FORMATS, export_dataframe, export_path
+from utils.instrument import RunProfile, profiling
+from utils.linear_model import LINEAR_MIN_CONFIDENCE, LINEAR_MODEL_PATH, LinearTier
+from utils.llm import LLM_MIN_CONFIDENCE, LLMClassifier
+from utils.ledger import DEFAULT_LEDGER_PATH, TransactionLedger
+from utils.scores import LabelSettings
+from utils.summary import SpendAggregator
+from utils.visualize import chart_png, plot_category_bar, plot_category_pie
 
 
 
@@ -22,6 +29,63 @@ env_path = pathlib.Path(__file__).parent / ".env"
 load_dotenv(dotenv_path=env_path)
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 MINILM_MODEL = os.getenv("MINILM_MODEL", "all-MiniLM-L6-v2")
+MINILM_BACKEND = os.getenv("MINILM_BACKEND", "torch")
+LEDGER_PATH = os.getenv("LEDGER_PATH", str(DEFAULT_LEDGER_PATH))
+LINEAR_PATH = os.getenv("LINEAR_MODEL_PATH", str(LINEAR_MODEL_PATH))
+EXEMPLARS_PATH = os.getenv("EXEMPLAR_INDEX_PATH", str(EXEMPLAR_INDEX_PATH))
+# Rows sent to the browser for the raw and labelled tables; the full frames stay server-side
+PREVIEW_ROWS = 1000
+
+
+@st.cache_resource(show_spinner=False)
+def get_categorizer(model_name: str, backend: str) -> HybridCategorizer:
+    # One categorizer per process: the model and prototype embeddings load lazily, once
+    llm = LLMClassifier(GEMINI_API_KEY) if GEMINI_API_KEY else None
+    try:
+        linear = LinearTier(LINEAR_PATH)
+    except ImportError:  # no scikit-learn: rule misses go straight to MiniLM
+        linear = None
+    # Corrections saved in earlier sessions
+    exemplars = ExemplarIndex.load(EXEMPLARS_PATH) if os.path.exists(EXEMPLARS_PATH) else None
+    return HybridCategorizer(model_name=model_name, backend=backend, llm=llm, linear_model=linear,
+                             exemplar_index=exemplars)
+
+
+@st.cache_resource(show_spinner=False)
+def get_ledger(path: str) -> TransactionLedger:
+    return TransactionLedger(path)
+
+
+def categorise(df: pd.DataFrame, settings: LabelSettings, use_ledger: bool,
+               relabel: bool = False) -> pd.DataFrame:
+    categorizer = get_categorizer(MINILM_MODEL, MINILM_BACKEND)
+    # A relabel only re-selects from cached scores; going through the ledger would miss on
+    # every row (the settings are part of its label version) and rewrite the whole frame
+    if use_ledger and not relabel:
+        # Rows seen in earlier uploads are served from the ledger instead of re-categorised
+        return get_ledger(LEDGER_PATH).categorize_df(df, categorizer, "Narration", settings, low_memory=True)
+    return categorizer.categorize_df(df, settings=settings, low_memory=True)
+
+
+def render_profile(profile: RunProfile) -> None:
+    report = profile.to_dict()
+    stages = pd.DataFrame.from_dict(report["stages"], orient="index")
+    if not stages.empty:
+        st.dataframe(stages.sort_values("seconds", ascending=False), use_container_width=True)
+    if report["tiers"]:
+        st.write("Tier hit rates")
+        st.dataframe(pd.DataFrame.from_dict(report["tiers"], orient="index"), use_container_width=True)
+    st.write("Encoder calls", report["encode"])
+    st.write("Peak memory (MB)", report["memory"]["peak_rss_mb"])
+    if report["slowest_descriptions"]:
+        st.write("Slowest descriptions (rule engine)")
+        st.dataframe(pd.DataFrame(report["slowest_descriptions"]), use_container_width=True)
+    st.download_button(
+        "Download profile (JSON)",
+        profile.to_json(indent=2),
+        file_name="categorisation_profile.json",
+        mime="application/json",
+    )
 
 # if not GEMINI_API_KEY:
 #     st.warning("⚠️ No OpenRouter API key found. Please add it in `.env` as `GEMINI_API_KEY=your_key_here`.")
@@ -37,18 +101,61 @@ allowed_categories = st.sidebar.multiselect(
 
 low_confidence_label = st.sidebar.text_input("Low-confidence label", "Uncategorized")
 rule_confidence = st.sidebar.slider("Rule confidence", 0.0, 1.0, 0.95, 0.05)
-llm_threshold = st.sidebar.slider("LLM acceptance threshold", 0.0, 1.0, 0.6, 0.05)
+llm_threshold = st.sidebar.slider(
+    "LLM acceptance threshold", 0.0, 1.0, LLM_MIN_CONFIDENCE, 0.05,
+    help="MiniLM matches weaker than this are sent to Gemini, and its answers need at least this confidence",
+    disabled=not GEMINI_API_KEY,
+)
 
 st.sidebar.divider()
+use_linear = st.sidebar.checkbox(
+    "Use learned text classifier", value=True,
+    help="A TF-IDF model trained on earlier rule matches; rows it is unsure about go to MiniLM",
+)
+linear_confidence = st.sidebar.slider("Text classifier confidence", 0.0, 1.0, LINEAR_MIN_CONFIDENCE, 0.05,
+                                      disabled=not use_linear)
 use_llm = st.sidebar.checkbox("Use  MiniLLM fallback", value=True)
-st.sidebar.write(f"Model: `{MINILM_MODEL}`")
+use_gemini = st.sidebar.checkbox(
+    "Send low-confidence rows to Gemini", value=bool(GEMINI_API_KEY), disabled=not GEMINI_API_KEY,
+    help="Needs GEMINI_API_KEY in .env; answers are cached locally",
+)
+st.sidebar.write(f"Model: `{MINILM_MODEL}` ({MINILM_BACKEND})")
+use_ledger = st.sidebar.checkbox("Remember categorised transactions", value=True)
+show_history = st.sidebar.checkbox("Include saved history in summary", value=False, disabled=not use_ledger)
+
+# Applied to cached scores, so changing these re-labels without re-running the model
+label_settings = LabelSettings(
+    allowed_categories=tuple(allowed_categories),
+    low_confidence_label=low_confidence_label,
+    rule_confidence=rule_confidence,
+    use_model=use_llm,
+    use_llm=use_gemini,
+    llm_confidence=llm_threshold,
+    use_linear=use_linear,
+    linear_confidence=linear_confidence,
+)
 
 
 # ---------- Session State ----------
-if "raw_df" not in st.session_state:
-    st.session_state.raw_df = None
+# Only the cleaned frame and a preview of the upload are kept between reruns
+if "clean_df" not in st.session_state:
+    st.session_state.clean_df = None
+if "raw_preview" not in st.session_state:
+    st.session_state.raw_preview = (None, 0)
+if "load_profile" not in st.session_state:
+    st.session_state.load_profile = None
 if "df_out" not in st.session_state:
     st.session_state.df_out = None
+if "run_profile" not in st.session_state:
+    st.session_state.run_profile = None
+if "source" not in st.session_state:
+    st.session_state.source = None
+if "labels_key" not in st.session_state:
+    st.session_state.labels_key = None
+if "aggregator" not in st.session_state:
+    st.session_state.aggregator = None
+if "history_aggregator" not in st.session_state:
+    st.session_state.history_aggregator = (None, None)
 
 
 # ---------- Data Input ----------
@@ -57,74 +164,129 @@ uploaded_file = st.file_uploader("Upload CSV file of Trasactions", type=["csv"])
 sample_btn = st.button("Use sample dataset")
 
 if sample_btn:
-    st.session_state.raw_df = pd.read_csv("data/Sample Transactions.csv")
+    source = "sample"
 elif uploaded_file is not None:
-    st.session_state.raw_df = pd.read_csv(uploaded_file)
-
-raw_df = st.session_state.raw_df
-print(raw_df)
-if raw_df is not None:
-    st.success(f"Loaded {len(raw_df)} transactions")
-    st.dataframe(raw_df, use_container_width=True)
-
-    if len(raw_df) < 30:
+    source = (uploaded_file.name, uploaded_file.size)
+else:
+    source = st.session_state.source
+if source != st.session_state.source:
+    # New data: read and clean it once; labels from the previous file no longer apply
+    st.session_state.source = source
+    st.session_state.df_out = None
+    st.session_state.run_profile = None
+    st.session_state.clean_df = None  # let the old frame go before the new one is read
+    with st.spinner("Cleaning data..."), profiling() as load_profile:
+        # dtype=str as in batch mode, so a Ref column with blanks is not read as float
+        raw_df = pd.read_csv("data/Sample Transactions.csv" if source == "sample" else uploaded_file, dtype=str)
+        st.session_state.clean_df = clean_dataframe(raw_df)
+    st.session_state.raw_preview = (raw_df.head(PREVIEW_ROWS), len(raw_df))
+    st.session_state.load_profile = load_profile
+    del raw_df
+
+df = st.session_state.clean_df
+if df is not None:
+    raw_preview, raw_rows = st.session_state.raw_preview
+    st.success(f"Loaded {raw_rows} transactions")
+    st.dataframe(raw_preview, use_container_width=True)
+
+    if raw_rows < 30:
         st.warning("Please upload at least 30 transactions for a full test.")
 
     # ---------- Cleaning ----------
     st.subheader("Data Cleaning and Preprocessing")
-    with st.spinner("Cleaning data..."):
-        df = clean_dataframe(raw_df)
+    # Summary and charts rerun on every interaction; cleaning runs on load and the model on click
+    page_profile = RunProfile()
     st.dataframe(df.head(20), use_container_width=True)
 
     # ---------- Categorization ----------
     st.subheader("Categorisation of Transactions")
 
+    labels_key = (label_settings, use_ledger)
     if st.button("Run Categorisation"):
         st.session_state.df_out = None  # clear previous run
+        st.session_state.aggregator = None
         with st.spinner("Categorising... please wait ⏳"):
             try:
-                categorizer = HybridCategorizer(
-                    # gemini_api_key=GEMINI_API_KEY, 
-                    # gemini_api_url="https://api.gemini.ai/v1/chat/completions",
-                    # model_name=MINILM_MODEL,
-                )
-                df_out = categorizer.categorize_df(df)
+                with profiling() as run_profile:
+                    df_out = categorise(df, label_settings, use_ledger)
+                    aggregator = SpendAggregator().add(df_out)
                 st.session_state.df_out = df_out
+                st.session_state.aggregator = aggregator
+                st.session_state.labels_key = labels_key
+                st.session_state.run_profile = run_profile
                 st.success("Categorisation complete")
             except Exception as e:
                 st.error(f"Error during categorisation: {e}")
 
 
+    elif st.session_state.df_out is not None and st.session_state.labels_key != labels_key:
+        # A sidebar change re-selects labels from the categorizer's cached scores, and only
+        # rows whose category moved are re-aggregated
+        relabel = st.session_state.labels_key[1] == use_ledger
+        try:
+            with profiling(page_profile):
+                df_out = categorise(df, label_settings, use_ledger, relabel=relabel)
+                st.session_state.aggregator.update(st.session_state.df_out, df_out)
+            st.session_state.df_out = df_out
+            st.session_state.labels_key = labels_key
+        except Exception as e:
+            # The previous labels stay on screen
+            st.error(f"Error while re-labelling: {e}")
+
+    if use_gemini and get_categorizer(MINILM_MODEL, MINILM_BACKEND).api_failed:
+        st.warning("Gemini is not responding; low-confidence rows keep the fallback label for now.")
+
     # ---------- Display Output ----------
     if st.session_state.df_out is not None:
         df_out = st.session_state.df_out
-        st.dataframe(df_out, use_container_width=True)
+        st.dataframe(df_out.head(PREVIEW_ROWS), use_container_width=True)
+        if len(df_out) > PREVIEW_ROWS:
+            st.caption(f"Showing the first {PREVIEW_ROWS:,} of {len(df_out):,} rows; export for the rest")
+
+        with st.expander("✏️ Correct a category"):
+            # Saved as an exemplar (and for the text classifier), so similar narrations follow it
+            # on the re-label below and in later sessions. Rule matches always win, so they are not offered
+            shown = df_out.head(PREVIEW_ROWS)
+            narration = st.selectbox("Narration", shown.loc[shown["Method"] != "Rule Engine", "Narration"].unique())
+            corrected = st.selectbox("Category", ALLOWED_CATEGORIES)
+            saved = False
+            if st.button("Save correction", disabled=narration is None):
+                try:
+                    categorizer = get_categorizer(MINILM_MODEL, MINILM_BACKEND)
+                    categorizer.add_corrections([narration], [corrected])
+                    categorizer.save_exemplars(EXEMPLARS_PATH)
+                    saved = True
+                except Exception as e:
+                    st.error(f"Error while saving the correction: {e}")
+            if saved:
+                # The cached scores were invalidated; this sends the rerun down the re-label branch
+                st.session_state.labels_key = (None, use_ledger)
+                st.rerun()
 
         # ---------- Summary ----------
         st.subheader("Summary & Insights")
 
+        aggregator = st.session_state.aggregator
+        if use_ledger and show_history:
+            ledger = get_ledger(LEDGER_PATH)
+            history_key = (len(ledger), labels_key)
+            if st.session_state.history_aggregator[0] != history_key:
+                with profiling(page_profile):
+                    history_agg = SpendAggregator().add(ledger.history())
+                st.session_state.history_aggregator = (history_key, history_agg)
+            aggregator = st.session_state.history_aggregator[1]
+            st.caption(f"Summary covers all {history_key[0]:,} saved transactions")
+
         # Ensure debit column exists
         if "Debit" not in df_out.columns:
             st.warning("Could not find a 'Debit' column for spend summary.")
         else:
-            df_out["Debit"] = pd.to_numeric(df_out["Debit"], errors="coerce").fillna(0)
+            # Read from the running totals; nothing here rescans the transactions
+            spend_by_cat = aggregator.by_category()
 
-            # Only consider rows where Debit > 0
-            debit_df = df_out[df_out["Debit"] > 0].copy()
-
-            if debit_df.empty:
+            if spend_by_cat.empty:
                 st.info("No debit transactions found for spend summary.")
             else:
-                debit_df["Category"] = debit_df["Category"].fillna("Uncategorized")
-
-                # Group spend by Category
-                spend_by_cat = (
-                    debit_df.groupby("Category")["Debit"]
-                    .sum()
-                    .abs()
-                    .sort_values(ascending=False)
-                )
-
                 total_spend = spend_by_cat.sum()
                 highest_category = spend_by_cat.idxmax() if not spend_by_cat.empty else "-"
                 top_categories = spend_by_cat.head(3)
@@ -141,23 +303,47 @@ if raw_df is not None:
                         )
                     )
 
-                # Visualizations
+                with st.expander("📅 Monthly Spend by Category"):
+                    unparsed = aggregator.unparsed_dates()
+                    if unparsed:
+                        st.warning(f"{unparsed:,} debit rows have a date that could not be read; "
+                                   "they count in the totals above but not in this table.")
+                    st.dataframe(aggregator.by_period("M"), use_container_width=True)
+
+                # Visualizations, re-rendered only when the totals change
+                summary_key = aggregator.content_hash()
                 col1, col2 = st.columns(2)
-                with col1:
-                    st.pyplot(plot_category_bar(spend_by_cat))
-                with col2:
-                    st.pyplot(plot_category_pie(spend_by_cat))
+                with col1, profiling(page_profile):
+                    st.image(chart_png(plot_category_bar, spend_by_cat, summary_key))
+                with col2, profiling(page_profile):
+                    st.image(chart_png(plot_category_pie, spend_by_cat, summary_key))
 
         # ---------- Export ----------
         st.subheader("Export Results")
-        csv_buf = io.StringIO()
-        df_out.to_csv(csv_buf, index=False)
-        st.download_button(
-            "Download Categorized CSV",
-            csv_buf.getvalue(),
-            file_name="categorized_transactions.csv",
-            mime="text/csv",
-        )
+        export_format = st.radio("Format", list(EXPORT_FORMATS), horizontal=True,
+                                 format_func={"csv": "CSV", "parquet": "Parquet", "arrow": "Arrow IPC"}.get)
+        # Encoded only when asked for, instead of on every rerun. Streamlit cannot stream a
+        # download: the button holds the whole file in memory, so very large statements are
+        # better exported with batch mode (cli.py), which writes straight to disk
+        if st.button("Prepare export"):
+            path = export_path(export_format)
+            try:
+                with st.spinner("Writing export..."):
+                    export_dataframe(df_out, path, export_format)
+                data = path.read_bytes()
+            finally:
+                path.unlink(missing_ok=True)
+            file_name = "categorized_transactions" + EXPORT_FORMATS[export_format][1]
+            st.download_button(
+                f"Download {file_name}",
+                data,
+                file_name=file_name,
+                mime=EXPORT_FORMATS[export_format][0],
+            )
 
     else:
         st.info("Upload a CSV file or click 'Use sample dataset' to begin.")
+
+    # ---------- Performance ----------
+    with st.expander("⏱️ Performance"):
+        render_profile(page_profile.merge(st.session_state.load_profile).merge(st.session_state.run_profile))
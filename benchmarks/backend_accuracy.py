@@ -0,0 +1,72 @@
+"""Compare an encoder backend against fp32 on a labeled statement.
+
+    python -m benchmarks.backend_accuracy labeled.csv --backend int8
+
+The CSV needs a Narration column; a Category column is used as the labels.
+Without one, rule-engine hits serve as labels. Exits non-zero when category
+agreement with fp32 falls below --min-agreement.
+"""
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+from utils.categorize import ALLOWED_CATEGORIES, HybridCategorizer
+from utils.embedding_backend import BACKENDS, backend_agreement, make_backend
+from utils.preprocess import clean_dataframe
+
+DEFAULT_MIN_AGREEMENT = 0.97
+
+
+def load_labeled(path: str):
+    df = pd.read_csv(path)
+    if "Category" in df.columns:
+        df = df.dropna(subset=["Narration", "Category"])
+        return df["Narration"].astype(str).tolist(), df["Category"].astype(str).tolist()
+    narrations = clean_dataframe(df)["Narration"].tolist()
+    rule_hits = HybridCategorizer(cache_dir=None).rules_classify_many(narrations)
+    pairs = [(n, cat) for n, (cat, _, _) in zip(narrations, rule_hits) if cat]
+    return [n for n, _ in pairs], [c for _, c in pairs]
+
+
+def throughput(backend, texts, batch_size: int) -> float:
+    backend.encode(texts[:batch_size], batch_size)  # warm-up
+    start = time.perf_counter()
+    backend.encode(texts, batch_size)
+    return len(texts) / (time.perf_counter() - start)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Category agreement and throughput of a backend vs fp32.")
+    parser.add_argument("labeled_csv")
+    parser.add_argument("--backend", choices=BACKENDS, default="int8")
+    parser.add_argument("--model", default=os.getenv("MINILM_MODEL", "all-MiniLM-L6-v2"))
+    parser.add_argument("--max-seq-length", type=int)
+    parser.add_argument("--threads", type=int)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--min-agreement", type=float, default=DEFAULT_MIN_AGREEMENT)
+    args = parser.parse_args(argv)
+
+    descriptions, labels = load_labeled(args.labeled_csv)
+    if not descriptions:
+        print("No labeled rows found.", file=sys.stderr)
+        return 1
+    reference = make_backend(args.model, "torch", args.max_seq_length, args.threads)
+    candidate = make_backend(args.model, args.backend, args.max_seq_length, args.threads)
+    texts = [HybridCategorizer.preprocess(d) for d in descriptions]
+
+    report = backend_agreement(reference, candidate, texts, ALLOWED_CATEGORIES, labels, args.batch_size)
+    report["reference_rows_per_sec"] = throughput(reference, texts, args.batch_size)
+    report["candidate_rows_per_sec"] = throughput(candidate, texts, args.batch_size)
+    for key, value in report.items():
+        print(f"{key:>24}: {value:,.4f}" if isinstance(value, float) else f"{key:>24}: {value}")
+    if report["agreement"] < args.min_agreement:
+        print(f"Agreement {report['agreement']:.3f} is below {args.min_agreement}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""Local stand-in for the Gemini generateContent endpoint, and a throughput check of the LLM tier.
+
+    python -m benchmarks.llm_stub --serve --port 8765      # then GEMINI_BASE_URL=http://127.0.0.1:8765
+    python -m benchmarks.llm_stub --rows 10000 --latency 2.0 --concurrency 8
+"""
+import argparse
+import json
+import pathlib
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from benchmarks.synthetic import generate_transactions  # noqa: E402
+from utils.categorize import ALLOWED_CATEGORIES, MERCHANT_HIERARCHY  # noqa: E402
+from utils.llm import LLMClassifier  # noqa: E402
+
+# First word of a merchant key -> its category, for plausible stub answers
+_KEYWORDS = {key.split()[0]: tags[0] for key, tags in MERCHANT_HIERARCHY.items()}
+
+
+# Replies a misbehaving model could send: wrong types in the answers, or no candidates at all
+MALFORMED_REPLIES = (
+    lambda answers: [dict(a, category=[a["category"]]) for a in answers],
+    lambda answers: [dict(a, category={"name": a["category"]}) for a in answers],
+    lambda answers: [dict(a, tag1=["Stub"]) for a in answers],
+    None,
+)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers every prompt after ``latency`` seconds; ``failure_rate`` of requests get a 503.
+
+    With ``malformed`` set, requests cycle through ``MALFORMED_REPLIES`` instead.
+    """
+
+    latency = 1.0
+    failure_rate = 0.0
+    malformed = False
+    requests = 0
+    _lock = threading.Lock()
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        with StubHandler._lock:
+            StubHandler.requests += 1
+            n = StubHandler.requests
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        prompt = body["contents"][0]["parts"][0]["text"]
+        time.sleep(self.latency)
+        if self.failure_rate and (n * self.failure_rate) % 1 < self.failure_rate:
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        categories = json.loads(re.search(r"^Categories: (.*)$", prompt, re.M).group(1))
+        answers = []
+        for idx, text in re.findall(r"^(\d+)\. (.*)$", prompt, re.M):
+            words = text.lower().split()
+            category = next((_KEYWORDS[w] for w in words if _KEYWORDS.get(w) in categories), categories[0])
+            answers.append({"id": int(idx), "category": category, "tag1": "Stub", "tag2": None,
+                            "tag3": None, "confidence": 0.9})
+        if self.malformed:
+            mangle = MALFORMED_REPLIES[n % len(MALFORMED_REPLIES)]
+            reply = {"candidates": None} if mangle is None else \
+                {"candidates": [{"content": {"parts": [{"text": json.dumps(mangle(answers))}]}}]}
+        else:
+            reply = {"candidates": [{"content": {"parts": [{"text": json.dumps(answers)}]}}]}
+        payload = json.dumps(reply).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def start_stub(port: int = 0, latency: float = 1.0, failure_rate: float = 0.0,
+               malformed: bool = False) -> ThreadingHTTPServer:
+    """Serve the stub on a background thread; ``server.server_address`` holds the bound port."""
+    StubHandler.latency = latency
+    StubHandler.failure_rate = failure_rate
+    StubHandler.malformed = malformed
+    StubHandler.requests = 0
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--serve", action="store_true", help="Only run the stub server until interrupted")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--rows", type=int, default=10_000, help="Fallback narrations to classify")
+    parser.add_argument("--latency", type=float, default=2.0, help="Stub seconds per request")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    parser.add_argument("--batch-size", type=int, default=25)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rpm", type=float, default=600, help="Requests per minute (0 = unlimited)")
+    args = parser.parse_args(argv)
+
+    server = start_stub(args.port, args.latency, args.failure_rate)
+    base_url = "http://{}:{}".format(*server.server_address)
+    if args.serve:
+        print(f"LLM stub listening on {base_url}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            return 0
+
+    # Suffixed so every row is distinct: the worst case, with nothing deduplicated or cached
+    pool = generate_transactions(args.rows, mix={"unknown": 1.0}, seed=0)["Narration"]
+    narrations = [f"{text} {i}" for i, text in enumerate(pool)]
+    llm = LLMClassifier(api_key="stub", base_url=base_url, batch_size=args.batch_size,
+                        max_concurrency=args.concurrency, requests_per_minute=args.rpm or None,
+                        cache_path=None)
+    start = time.perf_counter()
+    answers = llm.classify_many(narrations, ALLOWED_CATEGORIES)
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    print(json.dumps({
+        "rows": len(narrations),
+        "answered": sum(a is not None for a in answers),
+        "seconds": round(elapsed, 2),
+        "rows_per_sec": round(len(narrations) / elapsed, 1),
+        # One blocking call per row, as the old per-row llm_classify would have made
+        "sequential_estimate_seconds": round(len(narrations) * args.latency, 1),
+        **dict(llm.stats),
+    }, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""Per-stage throughput benchmarks.
+
+    python -m benchmarks.run --rows 1000 100000 --save-baseline
+    python -m benchmarks.run --rows 1000 100000          # fails on regression
+
+Each stage is timed on its own, then re-run under tracemalloc for peak memory.
+"""
+import argparse
+import json
+import pathlib
+import sys
+import time
+import tracemalloc
+
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt  # noqa: E402
+
+from benchmarks.synthetic import DEFAULT_MIX, generate_transactions  # noqa: E402
+from utils.categorize import LOW_CONF_LABEL, HybridCategorizer  # noqa: E402
+from utils.preprocess import clean_dataframe  # noqa: E402
+from utils.summary import spend_by_category  # noqa: E402
+from utils.visualize import plot_category_bar, plot_category_pie  # noqa: E402
+
+DEFAULT_BASELINE = pathlib.Path(__file__).parent / "baselines.json"
+DEFAULT_SIZES = [1_000, 100_000]
+DEFAULT_TOLERANCE = 0.25
+STAGES = ["clean", "rules", "minilm", "summary", "charts"]
+
+
+def _measure(fn, memory: bool):
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+    peak_mb = None
+    if memory:
+        tracemalloc.start()
+        fn()
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return result, seconds, peak_mb
+
+
+def _plot_both(spend):
+    for plot in (plot_category_bar, plot_category_pie):
+        plt.close(plot(spend))
+
+
+def bench_size(n_rows: int, stages, categorizer: HybridCategorizer, memory: bool, minilm_max_rows: int):
+    raw = generate_transactions(n_rows, DEFAULT_MIX)
+    results = {}
+
+    def record(stage, fn, rows):
+        value, seconds, peak_mb = _measure(fn, memory)
+        results[stage] = {
+            "rows": rows,
+            "seconds": round(seconds, 4),
+            "rows_per_sec": round(rows / seconds, 1) if seconds else None,
+            "peak_mb": round(peak_mb, 2) if peak_mb is not None else None,
+        }
+        return value
+
+    df = clean_dataframe(raw)
+    if "clean" in stages:
+        df = record("clean", lambda: clean_dataframe(raw), n_rows)
+
+    narrations = df["Narration"].tolist()
+    rule_hits = categorizer.rules_classify_many(narrations)
+    if "rules" in stages:
+        rule_hits = record("rules", lambda: categorizer.rules_classify_many(narrations), len(narrations))
+
+    if "minilm" in stages:
+        misses = [d for d, (cat, _, _) in zip(narrations, rule_hits) if not cat][:minilm_max_rows]
+        if misses:
+            categorizer._minilm_scores(misses[:8])  # load the model outside the timed region
+            record("minilm", lambda: categorizer._minilm_scores(misses), len(misses))
+
+    df["Category"] = [cat or LOW_CONF_LABEL for cat, _, _ in rule_hits]
+    spend = spend_by_category(df)
+    if "summary" in stages:
+        spend = record("summary", lambda: spend_by_category(df), len(df))
+    if "charts" in stages and not spend.empty:
+        record("charts", lambda: _plot_both(spend), len(df))
+    return results
+
+
+def check_regressions(report, baseline, tolerance: float):
+    failures = []
+    for size, stages in report.items():
+        for stage, current in stages.items():
+            base = baseline.get(size, {}).get(stage)
+            if not base:
+                continue
+            if base.get("rows_per_sec") and current["rows_per_sec"] is not None:
+                floor = base["rows_per_sec"] * (1 - tolerance)
+                if current["rows_per_sec"] < floor:
+                    failures.append(f"{size} rows / {stage}: {current['rows_per_sec']:,.0f} rows/s "
+                                    f"< {floor:,.0f} (baseline {base['rows_per_sec']:,.0f})")
+            if base.get("peak_mb") and current["peak_mb"] is not None:
+                ceiling = base["peak_mb"] * (1 + tolerance)
+                if current["peak_mb"] > ceiling:
+                    failures.append(f"{size} rows / {stage}: peak {current['peak_mb']:.1f} MB "
+                                    f"> {ceiling:.1f} MB (baseline {base['peak_mb']:.1f} MB)")
+    return failures
+
+
+def print_report(report) -> None:
+    print(f"{'rows':>10} {'stage':<8} {'seconds':>9} {'rows/s':>14} {'peak MB':>9}")
+    for size, stages in report.items():
+        for stage, r in stages.items():
+            peak = f"{r['peak_mb']:.1f}" if r["peak_mb"] is not None else "-"
+            rps = f"{r['rows_per_sec']:,.0f}" if r["rows_per_sec"] is not None else "-"
+            print(f"{size:>10} {stage:<8} {r['seconds']:>9.3f} {rps:>14} {peak:>9}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the categorisation pipeline stage by stage.")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_SIZES, help="Statement sizes to generate")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--skip-model", action="store_true", help="Skip the MiniLM stage (no model download)")
+    parser.add_argument("--minilm-max-rows", type=int, default=20_000, help="Cap on rows sent to MiniLM")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc peak-memory pass")
+    parser.add_argument("--baseline", type=pathlib.Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Write this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Allowed relative slowdown")
+    parser.add_argument("--json", type=pathlib.Path, help="Also write the report to this file")
+    args = parser.parse_args(argv)
+
+    stages = [s for s in args.stages if not (s == "minilm" and args.skip_model)]
+    # No embedding cache: the MiniLM stage should measure encoding, not cache reads
+    categorizer = HybridCategorizer(cache_dir=None)
+    report = {
+        str(n): bench_size(n, stages, categorizer, not args.no_memory, args.minilm_max_rows)
+        for n in args.rows
+    }
+    print_report(report)
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2))
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2))
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if args.baseline.exists():
+        failures = check_regressions(report, json.loads(args.baseline.read_text()), args.tolerance)
+        if failures:
+            print("Performance regressions:", *failures, sep="\n  ", file=sys.stderr)
+            return 1
+        print("No regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import random
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from utils.categorize import MERCHANT_HIERARCHY, friend_names
+from utils.matcher import MerchantMatcher
+
+# Share of each narration kind in a generated statement
+DEFAULT_MIX = {"rule": 0.6, "fuzzy": 0.15, "person": 0.1, "unknown": 0.15}
+
+PREFIXES = ["TO TRANSFER UPI/DR/", "BY TRANSFER UPI/CR/", "POS ", "NEFT/", ""]
+SUFFIXES = ["ORDER {n}@okhdfc", "{n}@okaxis", "#{n}", "REF {n}", "PAYMENT", ""]
+PERSON_NAMES = ["RAHUL VERMA", "SNEHA VERMA", "NEHA SINGH", "ARJUN MEHTA", "PRIYA IYER"]
+# Syllables that never spell a merchant key word; unknown narrations are built from these
+UNKNOWN_SYLLABLES = ["qu", "zy", "vex", "ko", "fy", "dr", "wu", "xo", "ky", "gz"]
+
+
+def _rule_narration(rng: random.Random, keys) -> str:
+    key = rng.choice(keys).upper()
+    return f"{rng.choice(PREFIXES)}{key} {rng.choice(SUFFIXES).format(n=rng.randint(10**5, 10**9))}".strip()
+
+
+def _fuzzy_narration(rng: random.Random, words) -> str:
+    # A single word of a (multi-word) merchant key: an all-words or any-word hit
+    return f"{rng.choice(PREFIXES)}{rng.choice(words).upper()} {rng.randint(100, 99999)}".strip()
+
+
+def _person_narration(rng: random.Random) -> str:
+    pattern = rng.choice(friend_names)
+    if pattern.endswith(("TO", "FROM")):
+        return f"BY TRANSFER {pattern} {rng.choice(PERSON_NAMES)}"
+    return f"TO TRANSFER UPI/DR/{pattern}"
+
+
+def _unknown_narration(rng: random.Random, matcher: MerchantMatcher) -> str:
+    while True:
+        word = "".join(rng.choice(UNKNOWN_SYLLABLES) for _ in range(rng.randint(2, 4)))
+        text = f"VPA {word.upper()} {rng.randint(1000, 9999)}"
+        if matcher.match(text.lower()) is None:
+            return text
+
+
+def _format_amount(value: float) -> str:
+    return f"{value:,.2f}" if value else ""
+
+
+def generate_transactions(n_rows: int, mix: Optional[Dict[str, float]] = None, seed: int = 0,
+                          start_date: str = "2022-01-01") -> pd.DataFrame:
+    """A raw statement in the shape of data/Sample Transactions.csv."""
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    keys = list(MERCHANT_HIERARCHY)
+    multi_words = sorted({w for k in keys if " " in k for w in k.split() if len(w) > 2})
+    matcher = MerchantMatcher(keys)
+
+    kinds = np_rng.choice(list(mix), size=n_rows, p=np.array(list(mix.values())) / sum(mix.values()))
+    # A small pool per kind keeps the realistic level of repeated narrations
+    pool_size = max(50, n_rows // 20)
+    pools = {
+        "rule": [_rule_narration(rng, keys) for _ in range(pool_size)],
+        "fuzzy": [_fuzzy_narration(rng, multi_words) for _ in range(pool_size)],
+        "person": [_person_narration(rng) for _ in range(pool_size)],
+        "unknown": [_unknown_narration(rng, matcher) for _ in range(pool_size)],
+    }
+    narrations = [pools[k][i] for k, i in zip(kinds, np_rng.integers(0, pool_size, n_rows))]
+
+    is_credit = np_rng.random(n_rows) < 0.15
+    amounts = np.round(np_rng.lognormal(mean=6.5, sigma=1.2, size=n_rows), 2)
+    debit = np.where(is_credit, 0.0, amounts)
+    credit = np.where(is_credit, amounts, 0.0)
+    balance = 100_000 + np.cumsum(credit - debit)
+    dates = pd.Timestamp(start_date) + pd.to_timedelta(np.sort(np_rng.integers(0, 3 * 365, n_rows)), unit="D")
+
+    return pd.DataFrame({
+        "Date": [f"{d.month}/{d.day}/{d.year}" for d in dates],
+        "Narration": narrations,
+        "Ref/Cheque No.": [f"UPI-{n}" for n in np_rng.integers(10**10, 10**11, n_rows)],
+        "Debit": [_format_amount(v) for v in debit],
+        "Credit": [_format_amount(v) for v in credit],
+        "Balance": [f"{v:,.2f}" for v in balance],
+    })
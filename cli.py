@@ -0,0 +1,160 @@
+import argparse
+import os
+import pathlib
+import sys
+import time
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+from utils.instrument import profiling
+from utils.preprocess import DEDUP_COLUMNS, clean_dataframe
+from utils.categorize import ENCODE_BATCH_SIZE, SHARD_SIZE, HybridCategorizer
+from utils.embedding_backend import BACKENDS
+from utils.exemplar_index import ExemplarIndex
+from utils.export import EXPORT_FORMATS, ExportWriter
+from utils.linear_model import LinearTier
+from utils.llm import LLM_MAX_CONCURRENCY, LLM_MIN_CONFIDENCE, LLM_REQUESTS_PER_MINUTE, LLMClassifier
+from utils.scores import LabelSettings
+from utils.summary import SpendAggregator
+from utils.ledger import TransactionLedger
+
+DEFAULT_CHUNKSIZE = 50_000
+
+
+class ChunkDeduplicator:
+    """Drops rows already seen in earlier chunks, like clean_dataframe's drop_duplicates.
+
+    Only a sorted array of 64-bit row hashes is kept: 8 bytes per unique row.
+    """
+
+    def __init__(self):
+        self.seen = np.empty(0, dtype=np.uint64)
+
+    def __call__(self, df: pd.DataFrame) -> pd.DataFrame:
+        keys = pd.util.hash_pandas_object(df[DEDUP_COLUMNS], index=False).to_numpy()
+        fresh = ~np.isin(keys, self.seen)
+        self.seen = np.union1d(self.seen, keys[fresh])
+        return df[fresh]
+
+
+def iter_categorized(path, categorizer: HybridCategorizer, chunksize: int = DEFAULT_CHUNKSIZE,
+                     desc_col: str = "Narration", n_jobs: int = 1, shard_size: int = SHARD_SIZE,
+                     ledger: Optional[TransactionLedger] = None, settings: Optional[LabelSettings] = None):
+    dedup = ChunkDeduplicator()
+    # dtype=str keeps every chunk's columns identical for cleaning and hashing
+    for chunk in pd.read_csv(path, chunksize=chunksize, dtype=str):
+        df = dedup(clean_dataframe(chunk))
+        if df.empty:
+            continue
+        df = df.reset_index(drop=True)
+        if ledger is not None:
+            yield ledger.categorize_df(df, categorizer, desc_col, settings, n_jobs=n_jobs,
+                                      shard_size=shard_size, low_memory=True)
+        else:
+            yield categorizer.categorize_df(df, desc_col=desc_col, n_jobs=n_jobs, shard_size=shard_size,
+                                           settings=settings, low_memory=True)
+
+
+def label_settings(args) -> LabelSettings:
+    return LabelSettings(min_confidence=args.min_confidence, llm_confidence=args.llm_confidence)
+
+
+def run(args) -> int:
+    llm = None
+    if args.llm:
+        llm = LLMClassifier(max_concurrency=args.llm_concurrency, requests_per_minute=args.llm_rpm)
+    categorizer = HybridCategorizer(
+        model_name=args.model, batch_size=args.batch_size, backend=args.backend,
+        max_seq_length=args.max_seq_length, num_threads=args.threads,
+        # Streaming never re-labels, and a score matrix would grow with every chunk
+        keep_scores=False, llm=llm,
+        linear_model=LinearTier(args.linear_model) if args.linear_model else None,
+        exemplar_index=ExemplarIndex.load(args.exemplars) if args.exemplars and os.path.exists(args.exemplars) else None,
+    )
+    if args.corrections:
+        corrections = pd.read_csv(args.corrections, dtype=str).dropna(subset=[args.desc_col, "Category"])
+        categorizer.add_corrections(corrections[args.desc_col].tolist(), corrections["Category"].tolist())
+        if args.exemplars:
+            categorizer.save_exemplars(args.exemplars)
+    ledger = TransactionLedger(args.ledger) if args.ledger else None
+    aggregator = SpendAggregator(dayfirst=args.dayfirst) if args.summary else None
+    start = time.perf_counter()
+    n_rows = 0
+    try:
+        with profiling() as profile, ExportWriter(args.output, args.format) as out:
+            chunks = iter_categorized(args.input, categorizer, args.chunksize, args.desc_col,
+                                      args.workers, args.shard_size, ledger, label_settings(args))
+            for df_out in chunks:
+                out.write(df_out)
+                if aggregator is not None:
+                    aggregator.add(df_out)
+                n_rows += len(df_out)
+                elapsed = time.perf_counter() - start
+                print(f"{n_rows:,} rows categorized ({n_rows / elapsed:,.0f} rows/s)", file=sys.stderr)
+    finally:
+        categorizer.close()
+    if aggregator is not None:
+        aggregator.by_period(args.summary_period).to_csv(args.summary)
+        if aggregator.unparsed_dates():
+            print(f"{aggregator.unparsed_dates():,} debit rows with an unreadable date left out of "
+                  f"{args.summary}", file=sys.stderr)
+    if args.profile:
+        pathlib.Path(args.profile).write_text(profile.to_json(indent=2), encoding="utf-8")
+    if n_rows == 0:
+        print("No transactions found.", file=sys.stderr)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Categorize a transactions CSV without the Streamlit UI.")
+    parser.add_argument("input", help="Input transactions CSV")
+    parser.add_argument("output", help="Output file with Category, Tag_1..3 and Method columns")
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="csv",
+                        help="Output format; parquet and arrow store the label columns dictionary-encoded")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="Rows read per chunk")
+    parser.add_argument("--batch-size", type=int, default=ENCODE_BATCH_SIZE, help="MiniLM encode batch size")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes (-1 = all cores)")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="Unique narrations per worker task")
+    parser.add_argument("--desc-col", default="Narration", help="Description column name")
+    parser.add_argument("--ledger", help="SQLite ledger; rows already stored there are not re-categorized")
+    parser.add_argument("--summary", help="Write debit spend per period and category to this CSV")
+    parser.add_argument("--summary-period", default="M", help="Period for --summary: D, W, M or Y")
+    parser.add_argument("--dayfirst", action="store_true", default=None,
+                        help="Read dates as day/month/year for --summary (default: detected)")
+    parser.add_argument("--profile", help="Write per-stage timings and tier hit rates to this JSON file")
+    parser.add_argument("--model", default=os.getenv("MINILM_MODEL", "all-MiniLM-L6-v2"), help="SentenceTransformer model")
+    parser.add_argument("--backend", choices=BACKENDS, help="Encoder backend (default: MINILM_BACKEND or torch)")
+    parser.add_argument("--max-seq-length", type=int, help="Token limit per narration (default: MINILM_MAX_SEQ_LENGTH or 64)")
+    parser.add_argument("--linear-model",
+                        help="TF-IDF model file tried before MiniLM; trained from rule hits as rows stream by")
+    parser.add_argument("--exemplars",
+                        help="Exemplar index (.npz) for the k-NN tier, e.g. the dashboard's .cache/exemplars.npz")
+    parser.add_argument("--corrections",
+                        help="CSV of known labels (description column and Category) added as exemplars before "
+                             "the run; saved to --exemplars when given")
+    parser.add_argument("--min-confidence", type=float,
+                        help="Rule confidences, exemplar vote shares and MiniLM similarities below this get the "
+                             "fallback label (default: none)")
+    parser.add_argument("--llm", action="store_true",
+                        help="Send unlabeled rows and weak MiniLM matches to Gemini (GEMINI_API_KEY, GEMINI_BASE_URL)")
+    parser.add_argument("--llm-confidence", type=float,
+                        help="MiniLM similarities below this go to Gemini, whose answers need at least this "
+                             f"confidence (default: {LLM_MIN_CONFIDENCE})")
+    parser.add_argument("--llm-concurrency", type=int, default=LLM_MAX_CONCURRENCY, help="Gemini requests in flight")
+    parser.add_argument("--llm-rpm", type=float, default=LLM_REQUESTS_PER_MINUTE, help="Gemini requests per minute")
+    parser.add_argument("--threads", type=int, help="Intra-op threads for the encoder (default: MINILM_THREADS)")
+    return parser
+
+
+def main(argv=None) -> int:
+    load_dotenv(dotenv_path=pathlib.Path(__file__).parent / ".env")
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,425 @@
+"""Local HTTP service holding one warm HybridCategorizer.
+
+    python service.py --port 8080 --max-batch-size 64 --max-wait-ms 5
+
+    POST /categorize       {"description": "POS SWIGGY 1234"}        -> {"Category": ..., "Tag_1": ..., "Method": ...}
+    POST /categorize/bulk  {"descriptions": ["...", "..."]}         -> {"results": [{...}, ...]}
+    GET  /metrics          latency percentiles, throughput and batch sizes
+    GET  /health
+"""
+import argparse
+import json
+import os
+import pathlib
+import queue
+import sys
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Optional, Sequence
+from urllib.parse import urlsplit
+
+import numpy as np
+from dotenv import load_dotenv
+
+from utils.categorize import ENCODE_BATCH_SIZE, RESULT_COLUMNS, HybridCategorizer
+from utils.embedding_backend import BACKENDS
+from utils.exemplar_index import ExemplarIndex
+from utils.linear_model import LinearTier
+from utils.llm import LLM_MAX_CONCURRENCY, LLM_MIN_CONFIDENCE, LLM_REQUESTS_PER_MINUTE, LLMClassifier
+from utils.scores import LabelSettings
+
+DEFAULT_PORT = 8080
+MAX_BATCH_SIZE = 64
+MAX_WAIT_MS = 5.0
+MAX_BULK_ROWS = 100_000
+REQUEST_TIMEOUT = 60.0
+# Longest a request waits for Gemini before it is answered with the local label; the
+# answer still arrives in the background and is cached for the next request
+LLM_WAIT = 10.0
+# Requests waiting on Gemini at once; beyond this they get the local labels straight away
+LLM_MAX_PENDING = 256
+# How often the embedding cache index is written while the service is busy
+CACHE_FLUSH_INTERVAL = 30.0
+# Pending connections the socket accepts; the stdlib default of 5 resets bursts of clients
+LISTEN_BACKLOG = 128
+# Requests kept for the latency percentiles, and the window for the recent throughput
+LATENCY_WINDOW = 10_000
+THROUGHPUT_WINDOW = 60.0
+
+
+class MicroBatcher:
+    """Runs ``fn`` on one background thread over batches coalesced from concurrent submissions.
+
+    A batch starts with the oldest waiting submission and takes more until
+    it holds ``max_batch_size`` rows or ``max_wait_ms`` has passed. A bulk
+    submission larger than the limit runs as a batch of its own. Items
+    are passed to ``fn`` as submitted, so they need not be strings.
+    """
+
+    def __init__(self, fn: Callable[[list], list], max_batch_size: int = MAX_BATCH_SIZE,
+                 max_wait_ms: float = MAX_WAIT_MS,
+                 on_batch: Optional[Callable[[int, float], None]] = None):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.on_batch = on_batch
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, items: Sequence) -> Future:
+        future: Future = Future()
+        self._queue.put((list(items), future))
+        return future
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch, size = [first], len(first[0])
+            deadline = time.monotonic() + self.max_wait
+            stop = False
+            while size < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+                size += len(item[0])
+            self._process(batch)
+            if stop:
+                return
+
+    def _process(self, batch) -> None:
+        items = [item for items, _ in batch for item in items]
+        start = time.perf_counter()
+        try:
+            results = self.fn(items)
+        except Exception as exc:  # every waiting request gets the error instead of hanging
+            for _, future in batch:
+                future.set_exception(exc)
+            return
+        if self.on_batch is not None:
+            self.on_batch(len(items), time.perf_counter() - start)
+        offset = 0
+        for submitted, future in batch:
+            future.set_result(results[offset:offset + len(submitted)])
+            offset += len(submitted)
+
+
+class ServiceMetrics:
+    """Thread-safe request, row and batch counters for the /metrics endpoint."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.counts: Counter = Counter()
+        self.methods: Counter = Counter()
+        self._latency = {"single": deque(maxlen=window), "bulk": deque(maxlen=window)}
+        # (finish time, rows) per request, for the throughput over the last THROUGHPUT_WINDOW seconds
+        self._recent: deque = deque()
+        self.batch_seconds = 0.0
+
+    def record_request(self, kind: str, rows: int, seconds: float, results) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self.counts["requests"] += 1
+            self.counts[f"{kind}_requests"] += 1
+            self.counts["rows"] += rows
+            self.methods.update(result[4] for result in results)
+            self._latency[kind].append(seconds)
+            self._recent.append((now, rows))
+            while self._recent and self._recent[0][0] < now - THROUGHPUT_WINDOW:
+                self._recent.popleft()
+
+    def record_error(self, status: int) -> None:
+        with self._lock:
+            self.counts[f"errors_{status}"] += 1
+
+    def record_event(self, name: str) -> None:
+        with self._lock:
+            self.counts[name] += 1
+
+    def record_batch(self, rows: int, seconds: float) -> None:
+        with self._lock:
+            self.counts["batches"] += 1
+            self.counts["batched_rows"] += rows
+            self.batch_seconds += seconds
+
+    @staticmethod
+    def _percentiles(latencies) -> dict:
+        if not latencies:
+            return {"count": 0, "p50_ms": None, "p99_ms": None}
+        p50, p99 = np.percentile(np.fromiter(latencies, dtype=float), [50, 99]) * 1000
+        return {"count": len(latencies), "p50_ms": round(float(p50), 3), "p99_ms": round(float(p99), 3)}
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            uptime = time.monotonic() - self.started
+            counts = dict(self.counts)
+            recent_rows = sum(rows for _, rows in self._recent)
+            latency = {kind: self._percentiles(values) for kind, values in self._latency.items()}
+            methods = dict(self.methods)
+            batch_seconds = self.batch_seconds
+        batches = counts.get("batches", 0)
+        return {
+            "uptime_seconds": round(uptime, 1),
+            "counts": counts,
+            "latency": latency,
+            "throughput": {
+                "rows_per_sec": round(counts.get("rows", 0) / uptime, 2) if uptime else None,
+                "recent_rows_per_sec": round(recent_rows / min(uptime, THROUGHPUT_WINDOW), 2) if uptime else None,
+                # Rows per second while the categorizer was actually working
+                "busy_rows_per_sec": round(counts.get("batched_rows", 0) / batch_seconds, 1) if batch_seconds else None,
+            },
+            "batching": {
+                "mean_batch_rows": round(counts.get("batched_rows", 0) / batches, 2) if batches else None,
+            },
+            "methods": methods,
+        }
+
+
+class CategorizationService:
+    """One warm categorizer behind a MicroBatcher, with metrics and periodic cache flushes.
+
+    The local tiers run on the batcher's thread. Rows left for Gemini go
+    through a second batcher, so a slow API never holds up the local tiers,
+    and a request waits at most ``llm_wait`` seconds for the answer.
+    """
+
+    def __init__(self, categorizer: HybridCategorizer, max_batch_size: int = MAX_BATCH_SIZE,
+                 max_wait_ms: float = MAX_WAIT_MS, flush_interval: float = CACHE_FLUSH_INTERVAL,
+                 settings: Optional[LabelSettings] = None, llm_wait: float = LLM_WAIT):
+        self.categorizer = categorizer
+        self.settings = settings
+        self.metrics = ServiceMetrics()
+        self.flush_interval = flush_interval
+        self.llm_wait = llm_wait
+        self._last_flush = time.monotonic()
+        self.batcher = MicroBatcher(self._categorize_batch, max_batch_size, max_wait_ms,
+                                    on_batch=self.metrics.record_batch)
+        self.llm_batcher = None
+        if categorizer.llm is not None and (settings is None or settings.use_llm):
+            # One Gemini call per batch; the client splits it into prompts sent concurrently
+            llm = categorizer.llm
+            self.llm_batcher = MicroBatcher(self._llm_batch, llm.batch_size * llm.max_concurrency, max_wait_ms)
+            self._llm_slots = threading.BoundedSemaphore(LLM_MAX_PENDING)
+
+    def _categorize_batch(self, descriptions: List[str]) -> list:
+        results, similarity = self.categorizer.categorize_local(descriptions, self.settings)
+        # Writing the cache index after every small batch would dominate the latency
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self._flush()
+        return list(zip(results, similarity))
+
+    def _llm_batch(self, rows: List[tuple]) -> list:
+        descriptions, results, similarity = zip(*rows)
+        return self.categorizer.llm_relabel(descriptions, list(results), self.settings,
+                                            np.array(similarity, dtype=float))
+
+    def _with_llm(self, descriptions: Sequence[str], results: list, similarity: np.ndarray) -> list:
+        pending = self.categorizer.llm_candidates(descriptions, results, self.settings, similarity)
+        if not pending:
+            return results
+        if not self._llm_slots.acquire(blocking=False):
+            self.metrics.record_event("llm_skipped")
+            return results
+        future = self.llm_batcher.submit([(descriptions[i], results[i], similarity[i]) for i in pending])
+        future.add_done_callback(lambda _: self._llm_slots.release())
+        try:
+            answers = future.result(self.llm_wait)
+        except FutureTimeoutError:
+            self.metrics.record_event("llm_timeouts")
+            return results
+        except Exception:  # the local labels are still a valid answer
+            self.metrics.record_event("llm_errors")
+            return results
+        for i, answer in zip(pending, answers):
+            results[i] = answer
+        return results
+
+    def _flush(self) -> None:
+        if self.categorizer.cache_dir is not None:
+            self.categorizer.embedding_cache.flush()
+        self._last_flush = time.monotonic()
+
+    def categorize(self, descriptions: Sequence[str], kind: str = "bulk", timeout: float = REQUEST_TIMEOUT) -> list:
+        start = time.perf_counter()
+        rows = self.batcher.submit(descriptions).result(timeout)
+        results = [result for result, _ in rows]
+        if self.llm_batcher is not None:
+            results = self._with_llm(descriptions, results, np.array([sim for _, sim in rows], dtype=float))
+        self.metrics.record_request(kind, len(descriptions), time.perf_counter() - start, results)
+        return results
+
+    def close(self) -> None:
+        self.batcher.close()
+        if self.llm_batcher is not None:
+            self.llm_batcher.close()
+        self._flush()
+        self.categorizer.close()
+
+
+def _as_record(result) -> dict:
+    return dict(zip(RESULT_COLUMNS, result))
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    service: CategorizationService = None
+    quiet = True
+
+    def log_message(self, fmt, *args) -> None:
+        if not self.quiet:
+            super().log_message(fmt, *args)
+
+    def _send_json(self, status: int, body) -> None:
+        if status >= 400:
+            self.service.metrics.record_error(status)
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self) -> None:
+        # Routed on the path alone, so e.g. /metrics?format=json still matches
+        path = urlsplit(self.path).path
+        if path == "/metrics":
+            self._send_json(200, self.service.metrics.to_dict())
+        elif path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": f"Unknown path {path}"})
+
+    def do_POST(self) -> None:
+        path = urlsplit(self.path).path
+        if path not in ("/categorize", "/categorize/bulk"):
+            self._send_json(404, {"error": f"Unknown path {path}"})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": "Body must be JSON"})
+            return
+
+        if path == "/categorize":
+            description = body.get("description") if isinstance(body, dict) else None
+            if not isinstance(description, str):
+                self._send_json(400, {"error": "Body must be a JSON object with a 'description' string"})
+                return
+            descriptions, kind = [description], "single"
+        else:
+            descriptions = body.get("descriptions") if isinstance(body, dict) else None
+            if not isinstance(descriptions, list) or not all(d is None or isinstance(d, str) for d in descriptions):
+                self._send_json(400, {"error": "'descriptions' must be a list of strings"})
+                return
+            if len(descriptions) > MAX_BULK_ROWS:
+                self._send_json(413, {"error": f"At most {MAX_BULK_ROWS:,} descriptions per request"})
+                return
+            kind = "bulk"
+
+        try:
+            results = self.service.categorize(descriptions, kind)
+        except FutureTimeoutError:
+            self._send_json(504, {"error": "Categorization timed out"})
+            return
+        except Exception as exc:
+            self._send_json(500, {"error": str(exc)})
+            return
+        if kind == "single":
+            self._send_json(200, _as_record(results[0]))
+        else:
+            self._send_json(200, {"results": [_as_record(r) for r in results]})
+
+
+def serve(service: CategorizationService, host: str = "127.0.0.1", port: int = DEFAULT_PORT,
+          quiet: bool = True) -> ThreadingHTTPServer:
+    """Bind the service; call ``serve_forever`` on the result (or run it on a thread)."""
+    handler = type("BoundServiceHandler", (ServiceHandler,), {"service": service, "quiet": quiet})
+    server_class = type("ServiceHTTPServer", (ThreadingHTTPServer,),
+                        {"request_queue_size": LISTEN_BACKLOG, "daemon_threads": True})
+    return server_class((host, port), handler)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE,
+                        help="Rows coalesced into one categorizer call")
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS,
+                        help="How long the first request of a batch waits for company")
+    parser.add_argument("--batch-size", type=int, default=ENCODE_BATCH_SIZE, help="MiniLM encode batch size")
+    parser.add_argument("--model", default=os.getenv("MINILM_MODEL", "all-MiniLM-L6-v2"), help="SentenceTransformer model")
+    parser.add_argument("--backend", choices=BACKENDS, help="Encoder backend (default: MINILM_BACKEND or torch)")
+    parser.add_argument("--max-seq-length", type=int, help="Token limit per narration (default: MINILM_MAX_SEQ_LENGTH or 64)")
+    parser.add_argument("--threads", type=int, help="Intra-op threads for the encoder (default: MINILM_THREADS)")
+    parser.add_argument("--linear-model", help="TF-IDF model file tried before MiniLM")
+    parser.add_argument("--exemplars", help="Exemplar index (.npz) for the k-NN tier, e.g. .cache/exemplars.npz")
+    parser.add_argument("--min-confidence", type=float,
+                        help="Rule confidences, exemplar vote shares and MiniLM similarities below this get the "
+                             "fallback label (default: none)")
+    parser.add_argument("--llm", action="store_true",
+                        help="Send unlabeled rows and weak MiniLM matches to Gemini (needs GEMINI_API_KEY)")
+    parser.add_argument("--llm-confidence", type=float,
+                        help="MiniLM similarities below this go to Gemini, whose answers need at least this "
+                             f"confidence (default: {LLM_MIN_CONFIDENCE})")
+    parser.add_argument("--llm-wait", type=float, default=LLM_WAIT,
+                        help="Seconds a request waits for Gemini before it gets the local label")
+    parser.add_argument("--llm-concurrency", type=int, default=LLM_MAX_CONCURRENCY, help="Gemini requests in flight")
+    parser.add_argument("--llm-rpm", type=float, default=LLM_REQUESTS_PER_MINUTE, help="Gemini requests per minute")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    return parser
+
+
+def main(argv=None) -> int:
+    load_dotenv(dotenv_path=pathlib.Path(__file__).parent / ".env")
+    args = build_parser().parse_args(argv)
+    llm = None
+    if args.llm:
+        llm = LLMClassifier(max_concurrency=args.llm_concurrency, requests_per_minute=args.llm_rpm)
+    categorizer = HybridCategorizer(
+        model_name=args.model, batch_size=args.batch_size, backend=args.backend,
+        max_seq_length=args.max_seq_length, num_threads=args.threads,
+        # Narrations rarely repeat exactly, so a score matrix would only grow; the
+        # embedding cache still serves repeats, and is flushed on an interval
+        keep_scores=False, autoflush=False, llm=llm,
+        linear_model=LinearTier(args.linear_model) if args.linear_model else None,
+        exemplar_index=ExemplarIndex.load(args.exemplars) if args.exemplars else None,
+    )
+    # Load the model and prototypes before the first request instead of during it;
+    # the LLM tier is left out so start-up never sends anything to Gemini
+    categorizer.categorize_local(["warm up"])
+    service = CategorizationService(categorizer, args.max_batch_size, args.max_wait_ms,
+                                    settings=LabelSettings(min_confidence=args.min_confidence,
+                                                           llm_confidence=args.llm_confidence),
+                                    llm_wait=args.llm_wait)
+    server = serve(service, args.host, args.port, quiet=not args.verbose)
+    print(f"Categorization service listening on http://{args.host}:{server.server_address[1]}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,5 @@
+import pathlib
+import sys
+
+# The repo is run from its root rather than installed, as in benchmarks/
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
@@ -0,0 +1,28 @@
+from benchmarks.llm_stub import start_stub
+from utils.categorize import HybridCategorizer
+from utils.llm import LLMClassifier, parse_answers
+from utils.scores import LabelSettings
+
+
+def test_parse_answers_drops_wrongly_typed_entries():
+    text = (
+        '[{"id": 1, "category": ["Shopping"]}, {"id": 2, "category": {"a": 1}},'
+        ' {"id": 3, "category": "Shopping", "tag1": ["x"]}, {"id": 4, "category": "Shopping", "tag1": "Mall"}]'
+    )
+    assert parse_answers(text, 4, ["Shopping"]) == [None, None, None, ("Shopping", "Mall", None, None, 0.85)]
+
+
+def test_malformed_replies_do_not_stop_a_run():
+    server = start_stub(latency=0.0, malformed=True)
+    try:
+        llm = LLMClassifier("stub", base_url="http://%s:%d" % server.server_address, batch_size=2,
+                            requests_per_minute=None, retries=0, max_failures=100, cache_path=None)
+        narrations = [f"VPA UNKNOWN SHOP {i}" for i in range(16)]
+        assert llm.classify_many(narrations, ["Shopping", "Travel"]) == [None] * len(narrations)
+
+        categorizer = HybridCategorizer(cache_dir=None, prototype_dir=None, llm=llm)
+        results = categorizer.categorize_many(narrations, LabelSettings(use_model=False))
+        assert [r[4] for r in results] == ["Fallback"] * len(narrations)
+        assert categorizer.awaiting_llm(narrations).all()
+    finally:
+        server.shutdown()
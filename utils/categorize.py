@@ -1,10 +1,28 @@
+import dataclasses
+import hashlib
+import itertools
+import json
+import multiprocessing
 import os
 import re
-from typing import Optional, Tuple
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Mapping, Optional, Sequence, Tuple
+import numpy as np
 import pandas as pd
 from difflib import get_close_matches
-from sentence_transformers import SentenceTransformer, util
-#import google.generativeai as genai
+
+from utils.embedding_backend import backend_config, make_backend
+from utils.embedding_cache import (
+    DEFAULT_CACHE_DIR, DEFAULT_MAX_ENTRIES, PROTOTYPE_DIR, EmbeddingCache, cached_prototypes,
+)
+from utils.exemplar_index import ExemplarIndex
+from utils.instrument import active_profile, timed
+from utils.linear_model import CORRECTION_WEIGHT, LINEAR_MIN_CONFIDENCE, LinearTier
+from utils.llm import LLM_MIN_CONFIDENCE, LLMClassifier
+from utils.matcher import MerchantMatcher
+from utils.scores import MAX_TAGS, TAG_THRESHOLD, LabelSettings, ScoreMatrix, top_tags
 
 # Merchant hierarchy
 MERCHANT_HIERARCHY = {
@@ -57,64 +75,310 @@ MERCHANT_HIERARCHY = {
     "rent payment": ("Housing", "Rent", "Apartment", "Monthly"),
 }
 
-ALLOWED_CATEGORIES = list({tags[0] for tags in MERCHANT_HIERARCHY.values()})
+ALLOWED_CATEGORIES = list(dict.fromkeys(tags[0] for tags in MERCHANT_HIERARCHY.values()))
 if "Friends and Family" not in ALLOWED_CATEGORIES:
     ALLOWED_CATEGORIES.append("Friends and Family")
 
 RULE_CONFIDENCE = 0.95
+# Confidence multiplier per rule tier: exact key, all key words, any key word
+RULE_TIER_FACTORS = (1.0, 0.9, 0.85)
 LOW_CONF_LABEL = "Others"
+ENCODE_BATCH_SIZE = 256
+# k-NN vote over labeled exemplars
+EXEMPLAR_K = 10
+EXEMPLAR_MIN_SIMILARITY = 0.5
+EXEMPLAR_MIN_SHARE = 0.6
+SHARD_SIZE = 10_000
+# Distinct narrations kept in the score matrix; past this it starts over empty
+MAX_SCORE_ROWS = 500_000
+
+RESULT_COLUMNS = ["Category", "Tag_1", "Tag_2", "Tag_3", "Method"]
 
 friend_names = [
     "TO RAHUL VERMA", "TO SNEHA VERMA", "IMPS TO", "IMPS FROM"
 ]
 
+
+def _load_encoder(model_name: str, config: dict):
+    # The backend imports torch itself, only once something has to be encoded
+    return make_backend(model_name, **config)
+
+
+_worker_categorizer = None
+
+
+def _init_worker(init_kwargs: dict) -> None:
+    global _worker_categorizer
+    # One intra-op thread per worker, otherwise N workers oversubscribe the cores.
+    # Workers share the parent's embedding cache; its file lock serialises their flushes.
+    # The parent runs the LLM tier once over all shards' fallback rows and
+    # learns exemplars from their rule hits, so every shard sees the same index.
+    # The linear tier comes in as a read-only snapshot that reloads from disk
+    _worker_categorizer = HybridCategorizer(**dict(init_kwargs, num_threads=1, keep_scores=False,
+                                                   llm=None, learn_from_rules=False))
+
+
+def _categorize_shard(descriptions: List[str], settings: Optional[LabelSettings] = None) -> Tuple[list, np.ndarray]:
+    if _worker_categorizer.linear_model is not None:
+        _worker_categorizer.linear_model.refresh()
+    descriptions = ["" if d is None else d for d in descriptions]
+    return _worker_categorizer._label(descriptions, _worker_categorizer.resolve_settings(settings))
+
+
 class HybridCategorizer:
     DESC_CANDIDATES = [
         "description", "desc", "narration", "memo", "details",
         "transaction description", "transaction", "remark", "remarks"
     ]
 
-    def __init__(self, model_name: str = "all-MiniLM-L6-v2", name_file_path: Optional[str] = None):
-        self.model = SentenceTransformer(model_name)
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2", name_file_path: Optional[str] = None,
+                 batch_size: int = ENCODE_BATCH_SIZE,
+                 merchant_hierarchy: Optional[Mapping[str, Tuple]] = None,
+                 cache_dir: Optional[str] = DEFAULT_CACHE_DIR, cache_size: int = DEFAULT_MAX_ENTRIES,
+                 prototype_dir: Optional[str] = PROTOTYPE_DIR,
+                 exemplar_index: Optional[ExemplarIndex] = None, exemplar_k: int = EXEMPLAR_K,
+                 learn_from_rules: bool = False, llm: Optional[LLMClassifier] = None,
+                 linear_model: Optional[LinearTier] = None,
+                 backend: Optional[str] = None, max_seq_length: Optional[int] = None,
+                 num_threads: Optional[int] = None, keep_scores: bool = True, autoflush: bool = True):
+        self.model_name = model_name
+        # Unset encoder options come from MINILM_BACKEND / MINILM_MAX_SEQ_LENGTH / MINILM_THREADS
+        self.encoder_config = backend_config(backend, max_seq_length, num_threads)
+        # Different backends and truncation give different vectors, so caches are keyed on all three
+        self.encoder_id = "{}:{}:{}".format(
+            model_name, self.encoder_config["backend"], self.encoder_config["max_seq_length"],
+        )
+        self.batch_size = batch_size
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self.prototype_dir = prototype_dir
+        # False leaves flushing the embedding cache to the caller, e.g. a service batching many small calls
+        self.autoflush = autoflush
+        self._init_kwargs = dict(
+            model_name=model_name, name_file_path=name_file_path, batch_size=batch_size,
+            merchant_hierarchy=merchant_hierarchy, cache_dir=cache_dir, cache_size=cache_size,
+            prototype_dir=prototype_dir, exemplar_k=exemplar_k,
+            learn_from_rules=learn_from_rules, llm=llm, linear_model=linear_model,
+            backend=backend, max_seq_length=max_seq_length,
+            num_threads=num_threads, keep_scores=keep_scores, autoflush=autoflush,
+        )
+        # Labeled narrations voted on before the category prototypes are tried
+        self.exemplar_index = exemplar_index
+        self.exemplar_k = exemplar_k
+        self.learn_from_rules = learn_from_rules
+        self._encoder = None
+        self._prototypes = None
+        self._embedding_cache = None
+        self._pool = None
+        self._pool_size = 0
+        self._pool_exemplars = None
+
+        self.merchant_hierarchy = dict(merchant_hierarchy or MERCHANT_HIERARCHY)
+        self.matcher = MerchantMatcher(self.merchant_hierarchy)
+        self._merchant_tags = list(self.merchant_hierarchy.values())
         self.name_list = set()
         if name_file_path and os.path.exists(name_file_path):
             with open(name_file_path, "r", encoding="utf-8") as f:
                 self.name_list = set(line.strip().lower() for line in f if line.strip())
-        self.category_embeddings = self.model.encode(ALLOWED_CATEGORIES, convert_to_tensor=True)
+        # Remote tier for rows still at the low-confidence label; api_failed mirrors its circuit breaker
+        self.llm = llm
         self.api_failed = False
+        # Narrations whose last LLM attempt got no answer; their labels are provisional
+        self._llm_unanswered = set()
+        # Cheap TF-IDF model tried before MiniLM; it learns from rule hits and corrections
+        self.linear_model = linear_model
+        self._linear_version = linear_model.version if linear_model is not None else 0
+
+        # Collect all unique subcategory tags from the merchant hierarchy, in a stable order
+        self.tag_vocabulary = list(dict.fromkeys(
+            tag for tags in self.merchant_hierarchy.values() for tag in tags[1:] if tag
+        ))
+        # Per-narration rule hits and similarity scores, reused when only the label settings change
+        self.scores = self._new_score_matrix() if keep_scores else None
+        # One categorizer may serve several threads (dashboard sessions, service
+        # handlers); the score matrix, embedding cache and exemplar index are not thread-safe
+        self._lock = threading.RLock()
+
+    @property
+    def encoder(self):
+        if self._encoder is None:
+            self._encoder = _load_encoder(self.model_name, self.encoder_config)
+        return self._encoder
+
+    def _prototype_key(self) -> str:
+        payload = json.dumps(
+            [self.encoder_id, ALLOWED_CATEGORIES, self.tag_vocabulary, self.merchant_hierarchy],
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
 
-        self.tag_vocabulary = set()
-        # Collect all unique subcategory tags from MERCHANT_HIERARCHY
-        for tags in MERCHANT_HIERARCHY.values():
-            for tag in tags[1:]:
-                if tag:
-                    self.tag_vocabulary.add(tag)
-        self.tag_vocabulary = list(self.tag_vocabulary)
-        # Compute embeddings once for tag vocabulary
-        self.tag_embeddings = self.model.encode(self.tag_vocabulary, convert_to_tensor=True)
+    def _load_prototypes(self):
+        if self._prototypes is None:
+            def build():
+                return {
+                    "categories": self._encode(ALLOWED_CATEGORIES),
+                    "tags": self._encode(self.tag_vocabulary),
+                }
+            if self.prototype_dir is None:
+                self._prototypes = build()
+            else:
+                self._prototypes = cached_prototypes(self._prototype_key(), build, self.prototype_dir)
+        return self._prototypes
 
+    @property
+    def category_embeddings(self) -> np.ndarray:
+        return self._load_prototypes()["categories"]
 
-    def preprocess(self, text: Optional[str]) -> str:
+    @property
+    def tag_embeddings(self) -> np.ndarray:
+        return self._load_prototypes()["tags"]
+
+    @property
+    def embedding_cache(self) -> Optional[EmbeddingCache]:
+        # Sized from the stored prototypes, so a warm cache never needs the encoder
+        if self._embedding_cache is None and self.cache_dir is not None:
+            dim = self.category_embeddings.shape[1]
+            self._embedding_cache = EmbeddingCache(self.encoder_id, dim, self.cache_dir, self.cache_size)
+        return self._embedding_cache
+
+    def _encode(self, texts: Sequence[str]) -> np.ndarray:
+        profile = active_profile()
+        if profile is not None:
+            profile.record_encode(len(texts))
+        # Unit-normalised rows, so a dot product is the cosine similarity
+        return self.encoder.encode(list(texts), self.batch_size)
+
+    def _encode_descriptions(self, descriptions: Sequence[Optional[str]]) -> np.ndarray:
+        # Narrations are embedded in their preprocessed form, which is also the cache key
+        texts = [self.preprocess(d) for d in descriptions]
+        if self.embedding_cache is None:
+            return self._encode(texts)
+        with self._lock:
+            emb = self.embedding_cache.get_or_encode(texts, self._encode)
+            if self.autoflush:
+                self.embedding_cache.flush()
+        return emb
+
+    def _top_tags(self, tag_sims: np.ndarray, max_tags: int = MAX_TAGS, threshold: float = TAG_THRESHOLD) -> List[List[Optional[str]]]:
+        return top_tags(tag_sims, self.tag_vocabulary, max_tags, threshold)
+
+    @timed("minilm_classify", rows=lambda self, descriptions: len(descriptions))
+    def _embedding_scores(self, descriptions: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, List[Tuple[Optional[str], float]]]:
+        """Category and tag similarity matrices plus the exemplar vote for each narration."""
+        # One encode for the whole batch, one matmul per prototype set
+        desc_emb = self._encode_descriptions(descriptions)
+        cat_sims = desc_emb @ self.category_embeddings.T
+        tag_sims = desc_emb @ self.tag_embeddings.T
+        if self.exemplar_index is not None and len(self.exemplar_index):
+            if self.exemplar_index.dim != desc_emb.shape[1]:
+                raise ValueError(f"Exemplar index holds {self.exemplar_index.dim}-d embeddings but "
+                                 f"{self.model_name} produces {desc_emb.shape[1]}-d ones")
+            votes = self.exemplar_index.vote(
+                desc_emb, self.exemplar_k, EXEMPLAR_MIN_SIMILARITY, EXEMPLAR_MIN_SHARE,
+            )
+        else:
+            votes = [(None, 0.0)] * len(descriptions)
+        return cat_sims, tag_sims, votes
+
+    def _minilm_scores(self, descriptions: Sequence[str]) -> List[Tuple[str, float, Tuple[Optional[str], ...], str]]:
+        if not descriptions:
+            return []
+        cat_sims, tag_sims, votes = self._embedding_scores(descriptions)
+        best_idx = cat_sims.argmax(axis=1)
+        best_scores = cat_sims[np.arange(len(descriptions)), best_idx]
+        scored = []
+        for i, sc, tags, (label, share) in zip(best_idx, best_scores, self._top_tags(tag_sims), votes):
+            # Exemplar votes take precedence over the category-name prototypes
+            if label is not None:
+                scored.append((label, share, tuple(tags), "Exemplar k-NN"))
+            else:
+                scored.append((ALLOWED_CATEGORIES[i], float(sc), tuple(tags), "MiniLM Fallback"))
+        return scored
+
+    def add_exemplars(self, descriptions: Sequence[str], categories: Sequence[str]) -> None:
+        """Add labeled narrations (e.g. user corrections) to the exemplar index."""
+        if not descriptions:
+            return
+        with self._lock:
+            embeddings = self._encode_descriptions(descriptions)
+            if self.exemplar_index is None:
+                self.exemplar_index = ExemplarIndex(embeddings.shape[1])
+            self.exemplar_index.add(embeddings, list(categories))
+            if self.scores is not None:
+                # Cached votes are stale; re-scoring hits the embedding cache
+                self.scores.invalidate_scores()
+
+    def add_corrections(self, descriptions: Sequence[str], categories: Sequence[str]) -> None:
+        """User-confirmed categories: added as exemplars and, weighted up, to the linear tier."""
+        with self._lock:
+            self.add_exemplars(descriptions, categories)
+            if self.linear_model is not None and descriptions:
+                # Refit straight away so the correction applies on the next call
+                self.linear_model.learn(
+                    [self.preprocess(d) for d in descriptions], [(c, None, None, None) for c in categories],
+                    CORRECTION_WEIGHT, force=True,
+                )
+
+    def save_exemplars(self, path) -> None:
+        """Write the exemplar index (e.g. after corrections) for ``ExemplarIndex.load``."""
+        with self._lock:
+            if self.exemplar_index is not None:
+                self.exemplar_index.save(path)
+
+    def _new_score_matrix(self) -> ScoreMatrix:
+        return ScoreMatrix(ALLOWED_CATEGORIES, self.tag_vocabulary, RULE_TIER_FACTORS)
+
+    def resolve_settings(self, settings: Optional[LabelSettings] = None) -> LabelSettings:
+        """Fill unset fields with the library defaults, which reproduce the unconfigured labels."""
+        settings = settings or LabelSettings()
+        allowed = settings.allowed_categories
+        return dataclasses.replace(
+            settings,
+            allowed_categories=tuple(allowed) if allowed is not None else None,
+            low_confidence_label=LOW_CONF_LABEL if settings.low_confidence_label is None else settings.low_confidence_label,
+            rule_confidence=RULE_CONFIDENCE if settings.rule_confidence is None else settings.rule_confidence,
+            min_confidence=-np.inf if settings.min_confidence is None else settings.min_confidence,
+            linear_confidence=LINEAR_MIN_CONFIDENCE if settings.linear_confidence is None else settings.linear_confidence,
+            llm_confidence=LLM_MIN_CONFIDENCE if settings.llm_confidence is None else settings.llm_confidence,
+        )
+
+
+    @staticmethod
+    def preprocess(text: Optional[str]) -> str:
         text = (text or "").lower()
         text = re.sub(r"[\/\-\_@]+", " ", text)
         text = re.sub(r"[^a-z0-9\s]", " ", text)
         text = re.sub(r"\s+", " ", text).strip()
         return text
 
+    def _rule_result(self, hit: Optional[Tuple[int, int]]) -> Tuple[Optional[str], float, Tuple[Optional[str], Optional[str], Optional[str]]]:
+        if hit is None:
+            return None, 0.0, (None, None, None)
+        tier, merchant_idx = hit
+        tags = self._merchant_tags[merchant_idx]
+        return tags[0], RULE_CONFIDENCE * RULE_TIER_FACTORS[tier], (tags[1], tags[2], tags[3])
+
     def rules_classify(self, description: str) -> Tuple[Optional[str], float, Tuple[Optional[str], Optional[str], Optional[str]]]:
-        desc = self.preprocess(description)
-        for merchant_key, tags in MERCHANT_HIERARCHY.items():
-            merchant_norm = merchant_key.lower()
-            if merchant_norm in desc:
-                return tags[0], RULE_CONFIDENCE, (tags[1], tags[2], tags[3])
-        for merchant_key, tags in MERCHANT_HIERARCHY.items():
-            words = merchant_key.split()
-            if all(word in desc for word in words if len(word) > 2):
-                return tags[0], RULE_CONFIDENCE * 0.9, (tags[1], tags[2], tags[3])
-        for merchant_key, tags in MERCHANT_HIERARCHY.items():
-            if any(w in desc for w in merchant_key.split()):
-                return tags[0], RULE_CONFIDENCE * 0.85, (tags[1], tags[2], tags[3])
-        return None, 0.0, (None, None, None)
+        return self._rule_result(self.matcher.match(self.preprocess(description)))
+
+    def rules_classify_many(self, descriptions: Sequence[Optional[str]]) -> List[Tuple[Optional[str], float, Tuple[Optional[str], Optional[str], Optional[str]]]]:
+        return [self._rule_result(hit) for hit in self._match_rules(descriptions)]
+
+    @timed("rules_classify", rows=lambda self, descriptions: len(descriptions))
+    def _match_rules(self, descriptions: Sequence[Optional[str]]) -> List[Optional[Tuple[int, int]]]:
+        profile = active_profile()
+        if profile is not None:
+            return self._match_rules_timed(descriptions, profile)
+        return self.matcher.match_many([self.preprocess(d) for d in descriptions])
+
+    def _match_rules_timed(self, descriptions, profile) -> list:
+        # Same as the fast path, but times every description for the slowest-rows report
+        hits = []
+        for description in descriptions:
+            start = time.perf_counter()
+            hits.append(self.matcher.match(self.preprocess(description)))
+            profile.record_description(description, time.perf_counter() - start)
+        return hits
 
     def _detect_person_name_dict(self, text: str) -> bool:
         if not text or not self.name_list:
@@ -134,54 +398,60 @@ class HybridCategorizer:
                 return True
         return False
 
-    # def llm_classify(self, description: str) -> Tuple[str, float, Tuple[Optional[str], Optional[str], Optional[str], str]]:
-    #     try:
-    #         model = genai.GenerativeModel("models/gemini-1.5-pro-latest")
-
-    #         prompt = (
-    #             "You are a finance assistant. Classify the following transaction into one main category "
-    #             "and up to three relevant tags describing the transaction.\n"
-    #             "Respond strictly in JSON format with keys: category, tag1, tag2, tag3.\n"
-    #             "If a tag is not applicable, use null.\n\n"
-    #             f"Transaction description: {description}\n\n"
-    #             "JSON Response:"
-    #         )
-
-    #         response = model.generate_content(
-    #             prompt,
-    #             generation_config=genai.types.GenerationConfig(
-    #                 temperature=0.0,
-    #                 max_output_tokens=60,
-    #                 top_p=1
-    #             )
-    #         )
-
-    #         content = response.text.strip()
-
-    #         import json
-    #         try:
-    #             data = json.loads(content)
-    #             category = data.get("category", LOW_CONF_LABEL)
-    #             tag1 = data.get("tag1")
-    #             tag2 = data.get("tag2")
-    #             tag3 = data.get("tag3")
-    #             return category, 0.85, (tag1, tag2, tag3, "Gemini LLM")
-    #         except json.JSONDecodeError:
-    #             # Fallback: treat whole content as category if JSON parsing fails
-    #             return content, 0.8, (None, None, None, "Gemini LLM")
-
-    #     except Exception as e:
-    #         print(f"LLM API error: {e}")
-    #         return LOW_CONF_LABEL, 0.0, (None, None, None, "Gemini LLM Failed")
-    def _minilm_tags(self, description: str, max_tags: int = 3, threshold: float = 0.4):
-        desc_emb = self.model.encode(description.lower(), convert_to_tensor=True)
-        similarities = util.cos_sim(desc_emb, self.tag_embeddings)[0]
-        tag_scores = [(self.tag_vocabulary[i], sim.item()) for i, sim in enumerate(similarities) if sim >= threshold]
-        tag_scores.sort(key=lambda x: x[1], reverse=True)
-        return [tag for tag, _ in tag_scores[:max_tags]]
-    
-    
-    def minilm_classify(self, description: str) -> Tuple[str, float, Tuple[None, None, None]]:
+    def llm_classify(self, description: str) -> Tuple[str, float, Tuple[Optional[str], Optional[str], Optional[str], str]]:
+        if self.llm is None:
+            return LOW_CONF_LABEL, 0.0, (None, None, None, "Gemini LLM Failed")
+        answer = self.llm.classify_many([description], ALLOWED_CATEGORIES)[0]
+        self.api_failed = self.llm.circuit_open
+        if answer is None:
+            return LOW_CONF_LABEL, 0.0, (None, None, None, "Gemini LLM Failed")
+        category, tag1, tag2, tag3, confidence = answer
+        return category, confidence, (tag1, tag2, tag3, "Gemini LLM")
+
+    @timed("llm_classify", rows=lambda self, descriptions, *args, **kwargs: len(descriptions))
+    def _llm_pending(self, descriptions: Sequence[str], results: List[Tuple],
+                     settings: LabelSettings, similarity: Optional[np.ndarray] = None) -> List[int]:
+        if self.llm is None or not settings.use_llm:
+            return []
+        # Unlabeled rows and weak MiniLM matches; a rejected answer leaves the MiniLM label.
+        # Person transfers are low-confidence on purpose and never leave the machine
+        unsure = np.zeros(len(results), dtype=bool) if similarity is None else similarity < settings.llm_confidence
+        return [
+            i for i, result in enumerate(results)
+            if (result[4] == "Fallback" or unsure[i]) and descriptions[i] and self._person_classify(descriptions[i]) is None
+        ]
+
+    def _llm_tier(self, descriptions: Sequence[str], results: List[Tuple],
+                  settings: LabelSettings, similarity: Optional[np.ndarray] = None) -> List[Tuple]:
+        pending = self._llm_pending(descriptions, results, settings, similarity)
+        if not pending:
+            return results
+
+        if self.llm.circuit_open:
+            answers = [None] * len(pending)
+        else:
+            categories = list(settings.allowed_categories or ALLOWED_CATEGORIES)
+            answers = self.llm.classify_many([descriptions[i] for i in pending], categories)
+        for i, answer in zip(pending, answers):
+            if answer is None:
+                self._llm_unanswered.add(descriptions[i])
+                continue
+            self._llm_unanswered.discard(descriptions[i])
+            if answer[4] >= settings.llm_confidence:
+                results[i] = (answer[0], answer[1], answer[2], answer[3], "Gemini LLM")
+        self.api_failed = self.llm.circuit_open
+        return results
+
+    def awaiting_llm(self, descriptions: Sequence[Optional[str]]) -> np.ndarray:
+        """True where the last LLM attempt for the description got no answer (API down, circuit open)."""
+        return np.fromiter((d in self._llm_unanswered for d in descriptions), dtype=bool, count=len(descriptions))
+
+    def _minilm_tags(self, description: str, max_tags: int = MAX_TAGS, threshold: float = TAG_THRESHOLD):
+        desc_emb = self._encode_descriptions([description])
+        tags = self._top_tags(desc_emb @ self.tag_embeddings.T, max_tags, threshold)[0]
+        return [tag for tag in tags if tag is not None]
+
+    def _person_classify(self, description: str) -> Optional[Tuple[str, float, Tuple[None, None, None]]]:
         if not description:
             return LOW_CONF_LABEL, 0.0, (None, None, None)
 
@@ -190,33 +460,109 @@ class HybridCategorizer:
 
         if self._detect_person_name_dict(description):
             return "Friends and Family", 0.99, (None, None, None)
+        return None
 
-        desc_emb = self.model.encode(description.lower(), convert_to_tensor=True)
-        similarities = util.cos_sim(desc_emb, self.category_embeddings)
-        max_idx = similarities.argmax().item()
-        best_cat = ALLOWED_CATEGORIES[max_idx]
-        best_score = similarities[0][max_idx].item()
-
-        tags = self._minilm_tags(description)
-        tags = (tags + [None]*3)[:3]
-        return best_cat, best_score, tuple(tags)
+    def minilm_classify(self, description: str) -> Tuple[str, float, Tuple[None, None, None]]:
+        person = self._person_classify(description)
+        if person is not None:
+            return person
+        return self._minilm_scores([description])[0][:3]
 
     def categorize(self, description: Optional[str]) -> Tuple[str, Optional[str], Optional[str], Optional[str], str]:
-        cat, conf, tags = self.rules_classify(description)
-        if cat:
-            return cat, tags[0], tags[1], tags[2], "Rule Engine"
+        return self.categorize_many([description])[0]
+
+    def categorize_many(self, descriptions: Sequence[Optional[str]],
+                        settings: Optional[LabelSettings] = None) -> List[Tuple[str, Optional[str], Optional[str], Optional[str], str]]:
+        settings = self.resolve_settings(settings)
+        descriptions = ["" if d is None else d for d in descriptions]
+        results, similarity = self._label(descriptions, settings)
+        # Tier 4: unlabelled rows and weak MiniLM matches go to the remote LLM in batched
+        # prompts, outside the lock so a slow API does not hold up other callers
+        return self._llm_tier(descriptions, results, settings, similarity)
 
-        cat, conf, tags = self.minilm_classify(description)
-        if cat and cat != LOW_CONF_LABEL:
-            return cat, tags[0], tags[1], tags[2], "MiniLM Fallback"
+    def categorize_local(self, descriptions: Sequence[Optional[str]],
+                         settings: Optional[LabelSettings] = None) -> Tuple[list, np.ndarray]:
+        """categorize_many without the LLM tier, plus the MiniLM similarity behind each label.
 
-        # cat, conf, tags = self.llm_classify(description)
-        # if cat:
-        #     if len(tags) == 4:
-        #         return cat, tags[0], tags[1], tags[2], tags[3]
-        #     return cat, None, None, None, "Gemini LLM"
+        For callers that run the (slow, remote) LLM tier on another thread:
+        pass both on to ``llm_candidates`` and ``llm_relabel``.
+        """
+        descriptions = ["" if d is None else d for d in descriptions]
+        return self._label(descriptions, self.resolve_settings(settings))
 
-        return LOW_CONF_LABEL, None, None, None, "Fallback"
+    def llm_candidates(self, descriptions: Sequence[Optional[str]], results: List[Tuple],
+                       settings: Optional[LabelSettings] = None, similarity: Optional[np.ndarray] = None) -> List[int]:
+        """Indices of the ``categorize_local`` rows the LLM tier would send to the API."""
+        return self._llm_pending(descriptions, results, self.resolve_settings(settings), similarity)
+
+    def llm_relabel(self, descriptions: Sequence[Optional[str]], results: List[Tuple],
+                    settings: Optional[LabelSettings] = None, similarity: Optional[np.ndarray] = None) -> List[Tuple]:
+        """The LLM tier over ``categorize_local`` output; ``results`` is updated in place and returned."""
+        descriptions = ["" if d is None else d for d in descriptions]
+        return self._llm_tier(descriptions, results, self.resolve_settings(settings), similarity)
+
+    def _label(self, descriptions: List[str], settings: LabelSettings) -> Tuple[list, np.ndarray]:
+        """Tiers 1-3: labels plus the MiniLM similarity behind each prototype label."""
+        with self._lock:
+            if self.scores is not None and len(self.scores) > MAX_SCORE_ROWS:
+                # Bounded memory for a long-lived categorizer; narrations seen again are
+                # re-scored from the rules and the embedding cache
+                self.scores = self._new_score_matrix()
+            scores = self.scores if self.scores is not None else self._new_score_matrix()
+
+            # Tier 1: rules and the cheap person-transfer checks, once per unseen narration
+            rows = self._score_rows(scores, descriptions)
+
+            # Tier 2: the linear model, so that only rows it is unsure about reach the transformer
+            self._linear_scores(scores, rows, settings)
+
+            # Tier 3: rows the settings send past the cheap tiers are encoded together, then
+            # exemplar k-NN / prototypes. Rows scored on an earlier call are not re-encoded.
+            pending = scores.needs_scores(rows, settings)
+            if len(pending):
+                cat_sims, tag_sims, votes = self._embedding_scores([scores.descriptions[i] for i in pending])
+                scores.set_scores(pending, cat_sims, tag_sims, votes)
+            return scores.select(rows, settings, with_similarity=True)
+
+    def _score_rows(self, scores: ScoreMatrix, descriptions: List[str]) -> np.ndarray:
+        rows = scores.lookup(descriptions)
+        if (rows >= 0).all():
+            return rows
+        new = list(dict.fromkeys(d for d, row in zip(descriptions, rows) if row < 0))
+        hits = self._match_rules(new)
+        rule_hits = [
+            (None, -1, (None, None, None)) if hit is None
+            else (self._merchant_tags[hit[1]][0], hit[0], tuple(self._merchant_tags[hit[1]][1:4]))
+            for hit in hits
+        ]
+        persons = []
+        for description in new:
+            person = self._person_classify(description)
+            # "" marks transfers that always go to the low-confidence label
+            persons.append(None if person is None else ("" if person[0] == LOW_CONF_LABEL else person[0]))
+        scores.add(new, rule_hits, persons)
+
+        hit_idx = [i for i, hit in enumerate(rule_hits) if hit[0]]
+        if self.linear_model is not None:
+            self.linear_model.learn(
+                [self.preprocess(new[i]) for i in hit_idx],
+                [(rule_hits[i][0],) + rule_hits[i][2] for i in hit_idx],
+            )
+        if self.learn_from_rules:
+            self.add_exemplars([new[i] for i in hit_idx], [rule_hits[i][0] for i in hit_idx])
+        return scores.lookup(descriptions)
+
+    def _linear_scores(self, scores: ScoreMatrix, rows: np.ndarray, settings: LabelSettings) -> None:
+        if self.linear_model is None:
+            return
+        if self.linear_model.version != self._linear_version:
+            # Refitted since these rows were predicted
+            scores.invalidate_linear()
+            self._linear_version = self.linear_model.version
+        pending = scores.needs_linear(rows, settings)
+        if len(pending) and self.linear_model.trained:
+            labels, confidence = self.linear_model.predict([self.preprocess(scores.descriptions[i]) for i in pending])
+            scores.set_linear(pending, labels, confidence)
 
     def _find_description_column(self, df: pd.DataFrame, desc_col: Optional[str]) -> Optional[str]:
         if desc_col and desc_col in df.columns:
@@ -231,13 +577,96 @@ class HybridCategorizer:
                     return orig
         return None
 
-    def categorize_df(self, df: pd.DataFrame, desc_col: Optional[str] = "Description") -> pd.DataFrame:
-        df = df.copy()
+    def categorize_parallel(self, descriptions: Sequence[str], n_jobs: int = -1,
+                            shard_size: int = SHARD_SIZE,
+                            settings: Optional[LabelSettings] = None) -> List[Tuple[str, Optional[str], Optional[str], Optional[str], str]]:
+        """categorize_many across a process pool; results come back in input order.
+
+        Workers keep no score matrix, so a later settings change re-scores these rows.
+        Workers do not train the linear tier or the exemplar index; rule hits
+        from their shards are learned here once the shards are back, so with
+        ``learn_from_rules`` the new exemplars apply from the next call on.
+        """
+        n_jobs = (os.cpu_count() or 1) if n_jobs < 1 else n_jobs
+        shards = [list(descriptions[i:i + shard_size]) for i in range(0, len(descriptions), shard_size)]
+        if n_jobs == 1 or len(shards) <= 1:
+            return self.categorize_many(descriptions, settings)
+
+        with self._lock:
+            pool = self._worker_pool(n_jobs)
+            results, similarity = [], []
+            for shard_results, shard_similarity in pool.map(_categorize_shard, shards, itertools.repeat(settings)):
+                results.extend(shard_results)
+                similarity.append(shard_similarity)
+            hits = [i for i, result in enumerate(results) if result[4] == "Rule Engine"]
+            if self.linear_model is not None:
+                self.linear_model.learn([self.preprocess(descriptions[i]) for i in hits], [results[i][:4] for i in hits])
+            if self.learn_from_rules:
+                # Once per narration, as categorize_many learns only unseen ones
+                learned = dict((descriptions[i], results[i][0]) for i in hits)
+                self.add_exemplars(list(learned), list(learned.values()))
+        return self._llm_tier(descriptions, results, self.resolve_settings(settings), np.concatenate(similarity))
+
+    def _worker_pool(self, n_jobs: int) -> ProcessPoolExecutor:
+        # Kept alive across calls so each worker loads the model only once.
+        # Workers hold a copy of the exemplar index, so exemplars added since
+        # (add_exemplars / add_corrections) need a fresh pool
+        exemplars = None if self.exemplar_index is None else (id(self.exemplar_index), len(self.exemplar_index))
+        if self._pool is not None and (self._pool_size != n_jobs or self._pool_exemplars != exemplars):
+            self.close()
+        if self._pool is None:
+            # Build the stored prototypes here instead of racing to build them in every worker
+            if self.prototype_dir is not None:
+                self._load_prototypes()
+            init_kwargs = dict(self._init_kwargs, exemplar_index=self.exemplar_index)
+            if self.linear_model is not None:
+                init_kwargs["linear_model"] = self.linear_model.snapshot()
+            self._pool = ProcessPoolExecutor(
+                max_workers=n_jobs, mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker, initargs=(init_kwargs,),
+            )
+            self._pool_size = n_jobs
+            self._pool_exemplars = exemplars
+        return self._pool
+
+    def close(self) -> None:
+        """Shut down the worker pool started by categorize_parallel, if any."""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+            self._pool_size = 0
+            self._pool_exemplars = None
+
+    @timed("categorize_df", rows=lambda self, df, *args, **kwargs: len(df))
+    def categorize_df(self, df: pd.DataFrame, desc_col: Optional[str] = "Description",
+                      n_jobs: int = 1, shard_size: int = SHARD_SIZE,
+                      settings: Optional[LabelSettings] = None, low_memory: bool = False) -> pd.DataFrame:
+        """Return ``df`` with the RESULT_COLUMNS added; the input frame is not modified.
+
+        With ``low_memory`` the label columns are categoricals (a code per row
+        plus one copy of each distinct label) and missing labels become NaN
+        instead of None.
+        """
+        # Shallow: only new or replaced columns are allocated, the rest share the caller's data
+        df = df.copy(deep=False)
         chosen_col = self._find_description_column(df, desc_col)
         if chosen_col is None:
             raise KeyError(f"No suitable description column found. Columns: {', '.join(df.columns)}")
 
         df[chosen_col] = df[chosen_col].fillna("").astype(str)
-        results = df[chosen_col].apply(lambda x: pd.Series(self.categorize(x)))
-        results.columns = ["Category", "Tag_1", "Tag_2", "Tag_3", "Method"]
-        return pd.concat([df, results], axis=1)
+        # Identical narrations are classified once and broadcast back
+        codes, uniques = pd.factorize(df[chosen_col])
+        if n_jobs == 1:
+            labels = self.categorize_many(list(uniques), settings)
+        else:
+            labels = self.categorize_parallel(list(uniques), n_jobs, shard_size, settings)
+        label_frame = pd.DataFrame(labels, columns=RESULT_COLUMNS)
+        for col in RESULT_COLUMNS:
+            if low_memory:
+                df[col] = pd.Categorical(label_frame[col]).take(codes)
+            else:
+                df[col] = label_frame[col].take(codes).set_axis(df.index)
+        profile = active_profile()
+        if profile is not None:
+            profile.record_tiers(df["Method"].value_counts().to_dict())
+        return df
@@ -0,0 +1,161 @@
+import os
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+BACKENDS = ("torch", "int8", "traced")
+DEFAULT_BACKEND = "torch"
+# Bank narrations are a handful of words; padding/attention beyond this is wasted work
+DEFAULT_MAX_SEQ_LENGTH = 64
+# Traced batches are padded to a multiple of this, bucketing sequence lengths
+PAD_MULTIPLE = 8
+
+
+class SentenceTransformerBackend:
+    """fp32 PyTorch eager inference through SentenceTransformer.encode."""
+
+    name = "torch"
+
+    def __init__(self, model_name: str, max_seq_length: Optional[int] = DEFAULT_MAX_SEQ_LENGTH,
+                 num_threads: Optional[int] = None):
+        # Imported lazily so torch is only loaded once something has to be encoded
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name, device="cpu")
+        if max_seq_length:
+            self.model.max_seq_length = max_seq_length
+        self.max_seq_length = self.model.max_seq_length
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: Sequence[str], batch_size: int = 32) -> np.ndarray:
+        """Unit-normalised float32 embeddings, one row per text."""
+        return self.model.encode(
+            list(texts),
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        ).astype(np.float32, copy=False)
+
+
+class QuantizedBackend(SentenceTransformerBackend):
+    """Dynamic int8 quantization of every nn.Linear (weights int8, activations quantized on the fly)."""
+
+    name = "int8"
+
+    def __init__(self, model_name: str, max_seq_length: Optional[int] = DEFAULT_MAX_SEQ_LENGTH,
+                 num_threads: Optional[int] = None):
+        super().__init__(model_name, max_seq_length, num_threads)
+        import torch
+
+        self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class TracedBackend(SentenceTransformerBackend):
+    """TorchScript graph of transformer + mean pooling, frozen for inference.
+
+    Texts are sorted by length and each batch is padded only to its longest
+    text, rounded up to a multiple of ``PAD_MULTIPLE`` so the graph sees a
+    handful of shapes. Padding every batch to ``max_seq_length`` made it
+    several times slower than eager inference on short narrations.
+    """
+
+    name = "traced"
+
+    def __init__(self, model_name: str, max_seq_length: Optional[int] = DEFAULT_MAX_SEQ_LENGTH,
+                 num_threads: Optional[int] = None):
+        super().__init__(model_name, max_seq_length, num_threads)
+        import torch
+
+        pooling = self.model[1]
+        # sentence-transformers 6 replaced get_pooling_mode_str() with a pooling_mode attribute
+        mode = pooling.get_pooling_mode_str() if hasattr(pooling, "get_pooling_mode_str") else pooling.pooling_mode
+        if mode != "mean":
+            raise ValueError(f"traced backend supports mean pooling only, {model_name} uses {mode}")
+
+        class _MeanPooledEncoder(torch.nn.Module):
+            def __init__(self, transformer):
+                super().__init__()
+                self.transformer = transformer
+
+            def forward(self, input_ids, attention_mask):
+                tokens = self.transformer(input_ids=input_ids, attention_mask=attention_mask, return_dict=False)[0]
+                mask = attention_mask.unsqueeze(-1).to(tokens.dtype)
+                pooled = (tokens * mask).sum(1) / mask.sum(1).clamp(min=1e-9)
+                return torch.nn.functional.normalize(pooled, p=2, dim=1)
+
+        self.tokenizer = self.model.tokenizer
+        encoder = _MeanPooledEncoder(self.model[0].auto_model).eval()
+        example = self._tokenize(["upi payment to merchant"])
+        with torch.no_grad():
+            traced = torch.jit.trace(encoder, (example["input_ids"], example["attention_mask"]), strict=False)
+            self.graph = torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+        self._torch = torch
+
+    def _tokenize(self, texts: Sequence[str]) -> Dict:
+        return self.tokenizer(
+            list(texts), padding="longest", pad_to_multiple_of=PAD_MULTIPLE, truncation=True,
+            max_length=self.max_seq_length, return_tensors="pt",
+        )
+
+    def encode(self, texts: Sequence[str], batch_size: int = 32) -> np.ndarray:
+        dim = self.get_sentence_embedding_dimension()
+        out = np.empty((len(texts), dim), dtype=np.float32)
+        # Similar lengths share a batch, so little of each batch is padding
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        with self._torch.no_grad():
+            for start in range(0, len(texts), batch_size):
+                rows = order[start:start + batch_size]
+                batch = self._tokenize([texts[i] for i in rows])
+                out[rows] = self.graph(batch["input_ids"], batch["attention_mask"]).numpy()
+        return out
+
+
+_BACKEND_CLASSES = {cls.name: cls for cls in (SentenceTransformerBackend, QuantizedBackend, TracedBackend)}
+
+
+def backend_config(backend: Optional[str] = None, max_seq_length: Optional[int] = None,
+                   num_threads: Optional[int] = None) -> Dict:
+    """Resolve settings, falling back to MINILM_BACKEND / MINILM_MAX_SEQ_LENGTH / MINILM_THREADS."""
+    backend = backend or os.getenv("MINILM_BACKEND", DEFAULT_BACKEND)
+    if backend not in _BACKEND_CLASSES:
+        raise ValueError(f"Unknown MiniLM backend {backend!r}; choose one of {', '.join(BACKENDS)}")
+    if max_seq_length is None:
+        max_seq_length = int(os.getenv("MINILM_MAX_SEQ_LENGTH", DEFAULT_MAX_SEQ_LENGTH))
+    if num_threads is None and os.getenv("MINILM_THREADS"):
+        num_threads = int(os.getenv("MINILM_THREADS"))
+    return {"backend": backend, "max_seq_length": max_seq_length, "num_threads": num_threads}
+
+
+def make_backend(model_name: str, backend: Optional[str] = None, max_seq_length: Optional[int] = None,
+                 num_threads: Optional[int] = None) -> SentenceTransformerBackend:
+    config = backend_config(backend, max_seq_length, num_threads)
+    cls = _BACKEND_CLASSES[config["backend"]]
+    return cls(model_name, config["max_seq_length"], config["num_threads"])
+
+
+def backend_agreement(reference: SentenceTransformerBackend, candidate: SentenceTransformerBackend,
+                      descriptions: Sequence[str], categories: Sequence[str],
+                      labels: Optional[Sequence[str]] = None, batch_size: int = 64) -> Dict[str, float]:
+    """How often ``candidate`` picks the same nearest category prototype as ``reference``.
+
+    With ``labels``, also reports each backend's accuracy against them.
+    """
+    picks = {}
+    for key, backend in (("reference", reference), ("candidate", candidate)):
+        prototypes = backend.encode(list(categories), batch_size)
+        emb = backend.encode(list(descriptions), batch_size)
+        picks[key] = np.asarray(categories)[(emb @ prototypes.T).argmax(axis=1)]
+
+    report = {"rows": len(descriptions), "agreement": float(np.mean(picks["reference"] == picks["candidate"]))}
+    if labels is not None:
+        labels = np.asarray(labels)
+        report["reference_accuracy"] = float(np.mean(picks["reference"] == labels))
+        report["candidate_accuracy"] = float(np.mean(picks["candidate"] == labels))
+    return report
@@ -0,0 +1,255 @@
+import hashlib
+import json
+import os
+import pathlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+CACHE_ROOT = pathlib.Path(".cache")
+DEFAULT_CACHE_DIR = CACHE_ROOT / "embeddings"
+PROTOTYPE_DIR = CACHE_ROOT / "prototypes"
+DEFAULT_MAX_ENTRIES = 100_000
+
+VECTORS_FILE = "vectors.f32"
+INDEX_FILE = "index.json"
+# Hash of the text each slot holds, 0 for an empty slot
+KEYS_FILE = "keys.u64"
+LOCK_FILE = "cache.lock"
+
+
+def _key_hash(text: str) -> int:
+    digest = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+    return digest or 1
+
+
+class EmbeddingCache:
+    """File-backed LRU cache of sentence embeddings.
+
+    Vectors live in a memory-mapped float32 array of ``max_entries`` slots and
+    a JSON index maps each normalized text to its slot in LRU order. Each
+    (model, dim, max_entries) configuration gets its own subdirectory of
+    ``cache_dir``, so encoders sharing the directory never overwrite or read
+    each other's vectors; a subdirectory is only reset when its files are
+    missing or corrupt.
+
+    Several processes may share a cache directory (the dashboard and a CLI
+    run, say). Writes and index flushes hold an exclusive file lock, each
+    slot records a hash of the text it holds, and a slot whose hash does not
+    match (another process reused it) is treated as a miss.
+    """
+
+    def __init__(self, model_name: str, dim: int, cache_dir=DEFAULT_CACHE_DIR,
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.model_name = model_name
+        self.dim = dim
+        self.max_entries = max_entries
+        self.cache_dir = pathlib.Path(cache_dir) / self._config_key()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._dirty = False
+
+        self._slots: "OrderedDict[str, int]" = OrderedDict()
+        self._free = []
+        self._index_mtime = None
+        self._lock_file = open(self.cache_dir / LOCK_FILE, "a+")
+        with self._locked():
+            self._vectors, self._keys = self._open()
+
+    @contextmanager
+    def _locked(self, exclusive: bool = True):
+        if fcntl is None:  # no advisory locks (Windows): the key check still catches reused slots
+            yield
+            return
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _meta(self) -> dict:
+        return {"model": self.model_name, "dim": self.dim, "max_entries": self.max_entries}
+
+    def _config_key(self) -> str:
+        payload = json.dumps(self._meta(), sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+    def _read_index(self) -> Optional[dict]:
+        idx_path = self.cache_dir / INDEX_FILE
+        if not idx_path.exists():
+            return None
+        try:
+            with open(idx_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return index if all(index.get(k) == v for k, v in self._meta().items()) else None
+
+    def _open(self) -> Tuple[np.memmap, np.memmap]:
+        vec_path = self.cache_dir / VECTORS_FILE
+        keys_path = self.cache_dir / KEYS_FILE
+        expected_bytes = self.max_entries * self.dim * np.dtype(np.float32).itemsize
+
+        index = self._read_index() if vec_path.exists() and keys_path.exists() else None
+        valid = (
+            index is not None
+            and vec_path.stat().st_size == expected_bytes
+            and keys_path.stat().st_size == self.max_entries * np.dtype(np.uint64).itemsize
+        )
+
+        if valid:
+            self._slots = OrderedDict((key, slot) for key, slot in index["entries"])
+            self._index_mtime = self._current_index_mtime()
+            mode = "r+"
+        else:
+            # First run, or files left corrupt or half-written: start from an empty cache
+            mode = "w+"
+        vectors = np.memmap(vec_path, dtype=np.float32, mode=mode, shape=(self.max_entries, self.dim))
+        keys = np.memmap(keys_path, dtype=np.uint64, mode=mode, shape=(self.max_entries,))
+        if not valid:
+            # Write the empty index now so other processes open these files instead of recreating them
+            keys.flush()
+            self._write_index()
+        used = set(self._slots.values())
+        self._free = [s for s in range(self.max_entries - 1, -1, -1) if s not in used]
+        return vectors, keys
+
+    def _allocate(self, key: str) -> int:
+        if self._free:
+            slot = self._free.pop()
+        else:
+            _, slot = self._slots.popitem(last=False)
+            self.evictions += 1
+        self._slots[key] = slot
+        return slot
+
+    def get_or_encode(self, texts: Sequence[str], encode: Callable[[Sequence[str]], np.ndarray]) -> np.ndarray:
+        """Return one embedding row per text, encoding only unseen texts."""
+        unique: Dict[str, int] = {}
+        for text in texts:
+            unique.setdefault(text, len(unique))
+        out = np.empty((len(unique), self.dim), dtype=np.float32)
+
+        # Read hits before inserting anything, since inserts may evict them
+        missing = []
+        with self._locked(exclusive=False):
+            for text, row in unique.items():
+                slot = self._slots.get(text)
+                if slot is not None and self._keys[slot] != _key_hash(text):
+                    # Another process has written this slot since our index was read
+                    del self._slots[text]
+                    slot = None
+                if slot is None:
+                    missing.append(text)
+                    continue
+                self._slots.move_to_end(text)
+                out[row] = self._vectors[slot]
+        self.hits += len(unique) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            fresh = np.asarray(encode(missing), dtype=np.float32)
+            for text, vec in zip(missing, fresh):
+                out[unique[text]] = vec
+            # Only the most recent max_entries can survive anyway
+            with self._locked():
+                if self._current_index_mtime() != self._index_mtime:
+                    # Another process flushed: pick up its entries so we do not overwrite their slots
+                    self._merge_index()
+                for text, vec in zip(missing[-self.max_entries:], fresh[-self.max_entries:]):
+                    slot = self._allocate(text)
+                    self._vectors[slot] = vec
+                    self._keys[slot] = _key_hash(text)
+            self._dirty = True
+
+        return out[[unique[text] for text in texts]]
+
+    def _merge_index(self) -> None:
+        # Keep entries other processes flushed since we read the index, as long as
+        # their slot is not one of ours and still holds their text
+        index = self._read_index()
+        if index is None:
+            return
+        used = set(self._slots.values())
+        merged: "OrderedDict[str, int]" = OrderedDict()
+        for key, slot in index["entries"]:
+            if key not in self._slots and slot not in used and self._keys[slot] == _key_hash(key):
+                merged[key] = slot
+                used.add(slot)
+        # Ours were used most recently
+        merged.update(self._slots)
+        self._slots = merged
+        self._index_mtime = self._current_index_mtime()
+        self._free = [s for s in range(self.max_entries - 1, -1, -1) if s not in used]
+
+    def _write_index(self) -> None:
+        index = dict(self._meta(), entries=list(self._slots.items()))
+        tmp_path = self.cache_dir / f"{INDEX_FILE}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.cache_dir / INDEX_FILE)
+        self._index_mtime = self._current_index_mtime()
+
+    def _current_index_mtime(self) -> Optional[int]:
+        try:
+            return (self.cache_dir / INDEX_FILE).stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def flush(self) -> None:
+        if not self._dirty:
+            return
+        with self._locked():
+            self._merge_index()
+            self._vectors.flush()
+            self._keys.flush()
+            self._write_index()
+        self._dirty = False
+
+    def clear(self) -> None:
+        with self._locked():
+            self._slots.clear()
+            self._free = list(range(self.max_entries - 1, -1, -1))
+            self._keys[:] = 0
+            self._keys.flush()
+            self._write_index()
+        self._dirty = False
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._slots),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def cached_prototypes(key: str, build: Callable[[], Dict[str, np.ndarray]],
+                      cache_dir=PROTOTYPE_DIR) -> Dict[str, np.ndarray]:
+    """Load named prototype arrays stored under ``key``, building and saving them on a miss."""
+    cache_dir = pathlib.Path(cache_dir)
+    path = cache_dir / f"{key}.npz"
+    if path.exists():
+        try:
+            with np.load(path) as data:
+                return {name: data[name] for name in data.files}
+        except (OSError, ValueError):
+            pass
+
+    arrays = build()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_dir / f"{key}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+    return arrays
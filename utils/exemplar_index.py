@@ -0,0 +1,158 @@
+import os
+import pathlib
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.embedding_cache import CACHE_ROOT
+
+try:
+    import faiss
+except ImportError:  # optional: approximate search for millions of exemplars
+    faiss = None
+
+# Corrections collected by the dashboard (and by batch mode's --exemplars) are kept here
+EXEMPLAR_INDEX_PATH = CACHE_ROOT / "exemplars.npz"
+# Upper bound on the (queries x exemplars) score block held in memory at once
+MAX_BLOCK_CELLS = 2 ** 26
+# HNSW graph degree and search breadth for the FAISS backend
+HNSW_M = 32
+HNSW_EF_SEARCH = 64
+
+
+class ExemplarIndex:
+    """Labeled narration embeddings searched by cosine similarity.
+
+    Embeddings must be unit-normalised. Exemplars can be added at any time
+    without rebuilding. The NumPy backend is an exact blocked matmul that
+    grows its buffer geometrically; the FAISS backend (used when installed,
+    or with ``backend="faiss"``) inserts into an HNSW graph, which keeps
+    queries sub-millisecond at millions of exemplars.
+    """
+
+    def __init__(self, dim: int, backend: str = "auto", capacity: int = 1024):
+        if backend == "auto":
+            backend = "faiss" if faiss is not None else "numpy"
+        if backend == "faiss" and faiss is None:
+            raise ImportError("backend='faiss' requires the faiss-cpu package")
+        if backend not in ("faiss", "numpy"):
+            raise ValueError(f"Unknown exemplar index backend: {backend}")
+        self.dim = dim
+        self.backend = backend
+        self.label_names: List[str] = []
+        self._label_ids = {}
+        self._size = 0
+        self._vectors = np.empty((capacity, dim), dtype=np.float32)
+        self._labels = np.empty(capacity, dtype=np.int32)
+        self._faiss = None
+        if backend == "faiss":
+            self._faiss = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            self._faiss.hnsw.efSearch = HNSW_EF_SEARCH
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _label_codes(self, labels: Sequence[str]) -> np.ndarray:
+        codes = np.empty(len(labels), dtype=np.int32)
+        for i, label in enumerate(labels):
+            code = self._label_ids.get(label)
+            if code is None:
+                code = self._label_ids[label] = len(self.label_names)
+                self.label_names.append(label)
+            codes[i] = code
+        return codes
+
+    def add(self, embeddings: np.ndarray, labels: Sequence[str]) -> None:
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if len(embeddings) != len(labels):
+            raise ValueError("embeddings and labels must have the same length")
+        self._add_arrays(embeddings, self._label_codes(labels), to_faiss=self._faiss is not None)
+
+    def _add_arrays(self, embeddings: np.ndarray, codes: np.ndarray, to_faiss: bool) -> None:
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        end = self._size + len(codes)
+        if end > len(self._labels):
+            capacity = max(end, 2 * len(self._labels))
+            self._vectors = np.resize(self._vectors, (capacity, self.dim))
+            self._labels = np.resize(self._labels, capacity)
+        self._vectors[self._size:end] = embeddings
+        self._labels[self._size:end] = codes
+        self._size = end
+        if to_faiss:
+            self._faiss.add(embeddings)
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-``k`` similarities and exemplar ids per query, best first."""
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        k = min(k, self._size)
+        if self._faiss is not None:
+            sims, ids = self._faiss.search(queries, k)
+            # HNSW pads with -1 when it finds fewer than k neighbours
+            return np.where(ids >= 0, sims, -1.0), np.maximum(ids, 0)
+
+        vectors = self._vectors[:self._size]
+        sims = np.empty((len(queries), k), dtype=np.float32)
+        ids = np.empty((len(queries), k), dtype=np.int64)
+        block = max(1, MAX_BLOCK_CELLS // max(self._size, 1))
+        for start in range(0, len(queries), block):
+            scores = queries[start:start + block] @ vectors.T
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            ids[start:start + block] = np.take_along_axis(top, order, axis=1)
+            sims[start:start + block] = np.take_along_axis(top_scores, order, axis=1)
+        return sims, ids
+
+    def vote(self, queries: np.ndarray, k: int = 10, min_similarity: float = 0.5,
+             min_share: float = 0.6) -> List[Tuple[Optional[str], float]]:
+        """Similarity-weighted k-NN vote; ``(label, share)`` or ``(None, 0.0)`` per query.
+
+        Only neighbours at or above ``min_similarity`` vote, and the winning
+        label needs at least ``min_share`` of their total weight.
+        """
+        if self._size == 0 or len(queries) == 0:
+            return [(None, 0.0)] * len(queries)
+        sims, ids = self.search(queries, k)
+        weights = np.where(sims >= min_similarity, sims, 0.0)
+        tally = np.zeros((len(queries), len(self.label_names)), dtype=np.float64)
+        rows = np.repeat(np.arange(len(queries)), sims.shape[1])
+        np.add.at(tally, (rows, self._labels[ids.ravel()]), weights.ravel())
+
+        totals = tally.sum(axis=1)
+        best = tally.argmax(axis=1)
+        shares = np.divide(tally[np.arange(len(queries)), best], totals,
+                           out=np.zeros(len(queries)), where=totals > 0)
+        return [
+            (self.label_names[b], float(sh)) if sh >= min_share else (None, 0.0)
+            for b, sh in zip(best, shares)
+        ]
+
+    def save(self, path) -> None:
+        arrays = {
+            "vectors": self._vectors[:self._size],
+            "labels": self._labels[:self._size],
+            "label_names": np.array(self.label_names, dtype=str),
+        }
+        if self._faiss is not None:
+            # Storing the graph avoids re-inserting every exemplar on load
+            arrays["faiss_index"] = faiss.serialize_index(self._faiss)
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Written aside and swapped in, so a reader never loads a half-written file
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, backend: str = "auto") -> "ExemplarIndex":
+        with np.load(path) as data:
+            vectors, labels = data["vectors"], data["labels"]
+            index = cls(vectors.shape[1], backend, capacity=max(len(labels), 1))
+            names = [str(n) for n in data["label_names"]]
+            if index._faiss is not None and "faiss_index" in data.files:
+                index._faiss = faiss.deserialize_index(data["faiss_index"])
+                index._faiss.hnsw.efSearch = HNSW_EF_SEARCH
+            index._add_arrays(vectors, index._label_codes([names[c] for c in labels]),
+                              to_faiss=index._faiss is not None and "faiss_index" not in data.files)
+        return index
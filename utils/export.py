@@ -0,0 +1,136 @@
+import os
+import pathlib
+import tempfile
+import time
+from typing import Optional
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional: only the columnar formats need it
+    pa = pq = None
+
+from utils.categorize import RESULT_COLUMNS
+from utils.embedding_cache import CACHE_ROOT
+
+EXPORT_DIR = CACHE_ROOT / "exports"
+EXPORT_CHUNK_ROWS = 50_000
+# The dashboard deletes each export once it is read, so only files left by an
+# interrupted run get this old; they are removed when the next export is created
+EXPORT_MAX_AGE = 3600.0
+# Format -> (MIME type, file extension). Arrow uses the IPC stream format, which,
+# unlike the IPC file format, lets each chunk carry its own label dictionary.
+EXPORT_FORMATS = {
+    "csv": ("text/csv", ".csv"),
+    "parquet": ("application/vnd.apache.parquet", ".parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", ".arrows"),
+}
+
+
+def _categorical_labels(df: pd.DataFrame) -> pd.DataFrame:
+    # Labels repeat a handful of values, so dictionary encoding shrinks them to small ints
+    columns = [c for c in RESULT_COLUMNS if c in df.columns]
+    return df.astype({c: "category" for c in columns})
+
+
+class ExportWriter:
+    """Appends DataFrame chunks to a CSV, Parquet or Arrow IPC stream file.
+
+    The schema is fixed by the first chunk; label columns are always
+    written as ``dictionary<int32, string>``.
+    """
+
+    def __init__(self, path, fmt: str = "csv"):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format {fmt!r}; choose one of {', '.join(EXPORT_FORMATS)}")
+        if fmt != "csv" and pa is None:
+            raise ImportError(f"{fmt} export requires the pyarrow package")
+        self.path = pathlib.Path(path)
+        self.fmt = fmt
+        self.rows = 0
+        self._file = None
+        self._writer = None
+        self._schema = None
+
+    def __enter__(self) -> "ExportWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _arrow_schema(self, table: "pa.Table") -> "pa.Schema":
+        fields = []
+        for field in table.schema:
+            if field.name in RESULT_COLUMNS:
+                field = field.with_type(pa.dictionary(pa.int32(), pa.string()))
+            elif pa.types.is_null(field.type):
+                # An all-empty column in the first chunk may hold text later on
+                field = field.with_type(pa.string())
+            elif pa.types.is_large_string(field.type):
+                field = field.with_type(pa.string())
+            fields.append(field)
+        return pa.schema(fields)
+
+    def write(self, df: pd.DataFrame) -> None:
+        if self.fmt == "csv":
+            if self._file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(self.path, "w", encoding="utf-8", newline="")
+            df.to_csv(self._file, header=(self.rows == 0), index=False)
+            self.rows += len(df)
+            return
+
+        table = pa.Table.from_pandas(_categorical_labels(df), preserve_index=False)
+        if self._schema is None:
+            self._schema = self._arrow_schema(table)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            if self.fmt == "parquet":
+                self._writer = pq.ParquetWriter(self.path, self._schema)
+            else:
+                self._writer = pa.ipc.new_stream(str(self.path), self._schema)
+        self._writer.write_table(table.cast(self._schema))
+        self.rows += len(df)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def export_dataframe(df: pd.DataFrame, path, fmt: str = "csv",
+                     chunk_rows: int = EXPORT_CHUNK_ROWS) -> pathlib.Path:
+    """Write ``df`` to ``path`` in ``chunk_rows`` slices, never holding the whole encoded file in memory."""
+    with ExportWriter(path, fmt) as writer:
+        for start in range(0, max(len(df), 1), chunk_rows):
+            writer.write(df.iloc[start:start + chunk_rows])
+    return writer.path
+
+
+def remove_stale_exports(directory: Optional[pathlib.Path] = None, max_age: float = EXPORT_MAX_AGE) -> int:
+    """Delete export files older than ``max_age`` seconds; returns how many went."""
+    directory = pathlib.Path(directory or EXPORT_DIR)
+    cutoff = time.time() - max_age
+    removed = 0
+    for path in directory.glob("*"):
+        try:
+            if path.is_file() and path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except FileNotFoundError:  # another session cleaned it up first
+            pass
+    return removed
+
+
+def export_path(fmt: str, stem: str = "categorized_transactions", directory: Optional[pathlib.Path] = None) -> pathlib.Path:
+    """A new, empty file for one export; concurrent sessions never share one. The caller deletes it."""
+    directory = pathlib.Path(directory or EXPORT_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    remove_stale_exports(directory)
+    fd, path = tempfile.mkstemp(prefix=f"{stem}-", suffix=EXPORT_FORMATS[fmt][1], dir=directory)
+    os.close(fd)
+    return pathlib.Path(path)
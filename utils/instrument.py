@@ -0,0 +1,178 @@
+import functools
+import heapq
+import json
+import os
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional
+
+try:
+    import psutil
+except ImportError:  # optional: /proc is read directly on Linux
+    psutil = None
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+_active: ContextVar[Optional["RunProfile"]] = ContextVar("active_profile", default=None)
+
+SLOWEST_N = 10
+MB = 1024 * 1024
+
+
+def rss_bytes() -> Optional[int]:
+    """Current resident set size of this process, or None where it cannot be read."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Highest resident set size this process has reached."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RunProfile:
+    """Wall time, row counts, tier hits and encode batch sizes for one run.
+
+    Instrumented functions only record while a profile is active (see
+    ``profiling``); otherwise the overhead is a single ContextVar lookup.
+    """
+
+    def __init__(self, slowest_n: int = SLOWEST_N):
+        self.slowest_n = slowest_n
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.stage_memory: Dict[str, Dict[str, float]] = {}
+        self.tiers: Counter = Counter()
+        self.encode_batches: List[int] = []
+        self._slowest: List = []
+
+    def record_stage(self, name: str, seconds: float, rows: Optional[int] = None,
+                     rss_before: Optional[int] = None, rss_after: Optional[int] = None) -> None:
+        stage = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0, "rows": 0})
+        stage["calls"] += 1
+        stage["seconds"] += seconds
+        stage["rows"] += rows or 0
+        if rss_before is not None and rss_after is not None:
+            self.record_memory(name, rss_after - rss_before, rss_after)
+
+    def record_memory(self, name: str, delta: int, resident: int) -> None:
+        # Growth is summed over calls; the resident size is the largest seen after a call
+        memory = self.stage_memory.setdefault(name, {"delta": 0, "resident": 0})
+        memory["delta"] += delta
+        memory["resident"] = max(memory["resident"], resident)
+
+    def record_tiers(self, counts) -> None:
+        self.tiers.update(counts)
+
+    def record_encode(self, batch_size: int) -> None:
+        self.encode_batches.append(batch_size)
+
+    def record_description(self, description: str, seconds: float) -> None:
+        item = (seconds, description)
+        if len(self._slowest) < self.slowest_n:
+            heapq.heappush(self._slowest, item)
+        elif item > self._slowest[0]:
+            heapq.heapreplace(self._slowest, item)
+
+    def merge(self, other: Optional["RunProfile"]) -> "RunProfile":
+        """A new profile holding both this profile's records and ``other``'s."""
+        merged = RunProfile(self.slowest_n)
+        for profile in (self, other):
+            if profile is None:
+                continue
+            for name, stage in profile.stages.items():
+                target = merged.stages.setdefault(name, {"calls": 0, "seconds": 0.0, "rows": 0})
+                for key in target:
+                    target[key] += stage[key]
+            for name, memory in profile.stage_memory.items():
+                merged.record_memory(name, memory["delta"], memory["resident"])
+            merged.tiers.update(profile.tiers)
+            merged.encode_batches.extend(profile.encode_batches)
+            for seconds, description in profile._slowest:
+                merged.record_description(description, seconds)
+        return merged
+
+    def to_dict(self) -> dict:
+        total_rows = sum(self.tiers.values())
+        batches = self.encode_batches
+        peak = peak_rss_bytes()
+        return {
+            "stages": {
+                name: {
+                    **stage,
+                    "seconds": round(stage["seconds"], 6),
+                    "rows_per_sec": round(stage["rows"] / stage["seconds"], 1) if stage["rows"] and stage["seconds"] else None,
+                    # Resident size after the stage, and how much the stage grew it
+                    "rss_mb": round(self.stage_memory[name]["resident"] / MB, 1) if name in self.stage_memory else None,
+                    "rss_delta_mb": round(self.stage_memory[name]["delta"] / MB, 1) if name in self.stage_memory else None,
+                }
+                for name, stage in self.stages.items()
+            },
+            "memory": {"peak_rss_mb": round(peak / MB, 1) if peak is not None else None},
+            "tiers": {
+                method: {"rows": n, "share": round(n / total_rows, 4)}
+                for method, n in self.tiers.most_common()
+            },
+            "encode": {
+                "calls": len(batches),
+                "texts": sum(batches),
+                "mean_batch": round(sum(batches) / len(batches), 1) if batches else 0,
+                "max_batch": max(batches, default=0),
+            },
+            # Per-description cost of preprocessing + rule matching
+            "slowest_descriptions": [
+                {"description": d, "ms": round(s * 1000, 3)}
+                for s, d in sorted(self._slowest, reverse=True)
+            ],
+        }
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.to_dict(), **kwargs)
+
+
+def active_profile() -> Optional[RunProfile]:
+    return _active.get()
+
+
+@contextmanager
+def profiling(profile: Optional[RunProfile] = None):
+    """Activate ``profile`` (or a new one) for instrumented calls in this block."""
+    profile = profile or RunProfile()
+    token = _active.set(profile)
+    try:
+        yield profile
+    finally:
+        _active.reset(token)
+
+
+def timed(name: str, rows: Optional[Callable[..., int]] = None):
+    """Record the wrapped function as stage ``name``; ``rows(*args, **kwargs)`` gives its row count."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            profile = _active.get()
+            if profile is None:
+                return fn(*args, **kwargs)
+            rss_before = rss_bytes()
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                n_rows = rows(*args, **kwargs) if rows else None
+                profile.record_stage(name, time.perf_counter() - start, n_rows, rss_before, rss_bytes())
+        return wrapper
+    return decorator
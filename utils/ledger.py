@@ -0,0 +1,192 @@
+import hashlib
+import json
+import pathlib
+import re
+import sqlite3
+import time
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from utils.categorize import RESULT_COLUMNS, SHARD_SIZE, HybridCategorizer
+from utils.instrument import active_profile, timed
+from utils.preprocess import AMOUNT_COLUMNS, DEDUP_COLUMNS, REQUIRED_COLUMNS
+from utils.scores import LabelSettings
+
+DEFAULT_LEDGER_PATH = pathlib.Path("data") / "ledger.sqlite"
+# Keys per "IN (...)" lookup, under SQLite's bound-parameter limit
+LOOKUP_CHUNK = 500
+# "12345.0": an all-digit column read as float because some cell was blank
+_INTEGRAL_FLOAT_TEXT = re.compile(r"^(-?\d+)\.0*$")
+
+# Column in the cleaned frame -> column in the ledger table
+_STORED_COLUMNS = {
+    "Date": "date", "Narration": "narration", "Ref/Cheque No.": "ref",
+    "Debit": "debit", "Credit": "credit", "Balance": "balance",
+    "Category": "category", "Tag_1": "tag_1", "Tag_2": "tag_2", "Tag_3": "tag_3", "Method": "method",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    key TEXT PRIMARY KEY,
+    date TEXT, narration TEXT, ref TEXT,
+    debit REAL, credit REAL, balance REAL,
+    category TEXT, tag_1 TEXT, tag_2 TEXT, tag_3 TEXT, method TEXT,
+    label_version TEXT NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+def _key_text(value) -> str:
+    """Text form of a Date / Narration / Ref cell that does not depend on how the CSV was parsed."""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return ""
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return str(int(value))
+    text = str(value).strip()
+    match = _INTEGRAL_FLOAT_TEXT.match(text)
+    return match.group(1) if match else text
+
+
+def row_keys(df: pd.DataFrame) -> pd.Series:
+    """Stable 64-bit hex key per cleaned row, from the columns clean_dataframe dedups on.
+
+    Unlike pandas' object hashing this is identical across pandas versions
+    and processes, so it can be stored.
+    """
+    parts = []
+    for col in DEDUP_COLUMNS:
+        values = df[col]
+        if col in AMOUNT_COLUMNS:
+            # NumPy's float formatting, so 1200 and "1,200.00" both give "1200.0". Empty CSV
+            # cells read as NaN while blank strings clean to 0; both mean "no amount".
+            amounts = np.nan_to_num(values.to_numpy(dtype=float, na_value=np.nan), nan=0.0)
+            parts.append(np.round(amounts, 2).astype(str))
+        else:
+            # Ref numbers come as "12345" from a dtype=str read but "12345.0" from a default
+            # read of a column with blanks; both must give the same key
+            parts.append([_key_text(v) for v in values.astype(object).where(values.notna(), None)])
+    keys = [
+        hashlib.sha1("\x1f".join(fields).encode("utf-8")).hexdigest()[:16]
+        for fields in zip(*parts)
+    ]
+    return pd.Series(keys, index=df.index, dtype=object)
+
+
+def label_version(categorizer: HybridCategorizer, settings: Optional[LabelSettings] = None) -> str:
+    """Identifies the encoder, merchant catalog and label settings a stored label was produced with."""
+    resolved = categorizer.resolve_settings(settings)
+    llm_model = categorizer.llm.model if categorizer.llm is not None else None
+    catalog = hashlib.sha256(
+        json.dumps(categorizer.merchant_hierarchy, sort_keys=True).encode("utf-8")
+    ).hexdigest()[:16]
+    parts = [categorizer.encoder_id, llm_model, repr(resolved), catalog]
+    if categorizer.linear_model is not None:
+        # Not the fitted version: a refit should not invalidate the whole ledger
+        parts.append("linear")
+    payload = json.dumps(parts)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class TransactionLedger:
+    """SQLite store of cleaned, categorized transactions keyed by ``row_keys``.
+
+    Rows already stored with the current label version are served from the
+    ledger; only new rows (or rows labelled under other settings) go
+    through the categorizer.
+    """
+
+    def __init__(self, path=DEFAULT_LEDGER_PATH):
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection per call, so one ledger can be shared across Streamlit sessions
+        return sqlite3.connect(self.path, timeout=30)
+
+    def __len__(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+
+    @timed("ledger_lookup", rows=lambda self, keys, version: len(keys))
+    def lookup(self, keys, version: str) -> pd.DataFrame:
+        """Stored labels (RESULT_COLUMNS, indexed by key) for ``keys`` labelled under ``version``."""
+        unique = list(dict.fromkeys(keys))
+        rows = []
+        with self._connect() as conn:
+            for start in range(0, len(unique), LOOKUP_CHUNK):
+                chunk = unique[start:start + LOOKUP_CHUNK]
+                rows.extend(conn.execute(
+                    "SELECT key, category, tag_1, tag_2, tag_3, method FROM transactions "
+                    f"WHERE label_version = ? AND key IN ({','.join('?' * len(chunk))})",
+                    [version, *chunk],
+                ))
+        return pd.DataFrame(rows, columns=["key", *RESULT_COLUMNS]).set_index("key")
+
+    @timed("ledger_save", rows=lambda self, df, keys, version: len(df))
+    def save(self, df: pd.DataFrame, keys: pd.Series, version: str) -> None:
+        """Insert or replace categorized rows; ``df`` needs REQUIRED_COLUMNS and RESULT_COLUMNS."""
+        stored = df[list(_STORED_COLUMNS)].astype(object)
+        stored = stored.where(stored.notna(), None)
+        now = time.time()
+        records = [
+            (key, *values, version, now)
+            for key, values in zip(keys, stored.itertuples(index=False, name=None))
+        ]
+        with self._connect() as conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO transactions (key, {', '.join(_STORED_COLUMNS.values())}, "
+                f"label_version, updated_at) VALUES ({','.join('?' * (len(_STORED_COLUMNS) + 3))})",
+                records,
+            )
+
+    def history(self) -> pd.DataFrame:
+        """Every stored transaction in insertion order, with the cleaned and result column names."""
+        with self._connect() as conn:
+            df = pd.read_sql_query(
+                f"SELECT {', '.join(_STORED_COLUMNS.values())} FROM transactions ORDER BY rowid", conn,
+            )
+        return df.rename(columns={v: k for k, v in _STORED_COLUMNS.items()})
+
+    def categorize_df(self, df: pd.DataFrame, categorizer: HybridCategorizer,
+                      desc_col: Optional[str] = "Narration", settings: Optional[LabelSettings] = None,
+                      n_jobs: int = 1, shard_size: int = SHARD_SIZE, low_memory: bool = False) -> pd.DataFrame:
+        """Same output as ``categorizer.categorize_df``, categorizing only rows not in the ledger.
+
+        ``df`` must be the output of ``clean_dataframe``.
+        """
+        missing = [c for c in REQUIRED_COLUMNS if c not in df.columns]
+        if missing:
+            raise KeyError(f"Ledger needs cleaned columns, missing: {', '.join(missing)}")
+        version = label_version(categorizer, settings)
+        keys = row_keys(df)
+        stored = self.lookup(keys, version)
+        known = keys.isin(stored.index).to_numpy()
+
+        results = np.full((len(df), len(RESULT_COLUMNS)), None, dtype=object)
+        if known.any():
+            results[known] = stored.loc[keys[known], RESULT_COLUMNS].to_numpy()
+        if not known.all():
+            fresh = categorizer.categorize_df(df[~known], desc_col, n_jobs, shard_size, settings)
+            # Labels the LLM could not weigh in on are not kept, so the rows go to it again next time
+            answered = ~categorizer.awaiting_llm(fresh[desc_col if desc_col in fresh.columns else "Narration"])
+            self.save(fresh[answered], keys[~known][answered], version)
+            results[~known] = fresh[RESULT_COLUMNS].to_numpy()
+            del fresh
+
+        profile = active_profile()
+        if profile is not None and known.any():
+            profile.record_tiers({"Ledger": int(known.sum())})
+        results[pd.isna(results)] = None
+        df = df.copy(deep=False)
+        for i, col in enumerate(RESULT_COLUMNS):
+            if low_memory:
+                df[col] = pd.Categorical(results[:, i])
+            else:
+                df[col] = pd.Series(results[:, i], index=df.index, dtype=object)
+        return df
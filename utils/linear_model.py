@@ -0,0 +1,195 @@
+import importlib.util
+import os
+import pathlib
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.embedding_cache import CACHE_ROOT
+from utils.instrument import timed
+
+LINEAR_MODEL_PATH = CACHE_ROOT / "linear_model.joblib"
+# Predictions below this probability are left to the embedding tiers
+LINEAR_MIN_CONFIDENCE = 0.6
+# No model is fitted before this many distinct labeled narrations
+LINEAR_MIN_EXAMPLES = 50
+# Refit once new or changed examples reach this share of the last training set
+LINEAR_RETRAIN_GROWTH = 0.2
+# A user correction counts this many times over a rule-engine label
+CORRECTION_WEIGHT = 5.0
+# Stored examples per label; beyond this the oldest rule hits make way, corrections go last
+LINEAR_MAX_EXAMPLES_PER_LABEL = 2000
+NGRAM_RANGE = (2, 4)
+
+# (category, tag_1, tag_2, tag_3)
+LinearLabel = Tuple[str, Optional[str], Optional[str], Optional[str]]
+
+_SEP = "\x1f"
+
+
+def _encode_label(label: Sequence[Optional[str]]) -> str:
+    # scikit-learn needs sortable class labels; tuples holding None are not
+    return _SEP.join("" if part is None else part for part in label)
+
+
+def _decode_label(key: str) -> LinearLabel:
+    parts = [part or None for part in key.split(_SEP)]
+    return tuple((parts + [None] * 4)[:4])
+
+
+class LinearTier:
+    """Character n-gram TF-IDF and logistic regression over labeled narrations.
+
+    Sits between the rules and MiniLM: it learns from rule-engine hits and
+    user corrections, predicts the full (category, tags) label, and rows it
+    is not confident about go on to the embedding model. This is a periodic
+    refit, not online learning: examples are kept with the model in one
+    joblib file, and the model is refitted from scratch on them once new or
+    changed examples reach ``retrain_growth`` of the last training set. At
+    most ``max_per_label`` examples are kept per label, so both the file and
+    the refit stay bounded however long the tier keeps learning.
+    """
+
+    def __init__(self, path=LINEAR_MODEL_PATH, min_examples: int = LINEAR_MIN_EXAMPLES,
+                 retrain_growth: float = LINEAR_RETRAIN_GROWTH, read_only: bool = False,
+                 max_per_label: int = LINEAR_MAX_EXAMPLES_PER_LABEL):
+        # scikit-learn is optional and slow to import, so it is only checked for here
+        # and imported where it is used; without it rule misses go straight to MiniLM
+        if importlib.util.find_spec("sklearn") is None:
+            raise ImportError("the linear tier requires scikit-learn")
+        self.path = pathlib.Path(path) if path is not None else None
+        self.min_examples = min_examples
+        self.retrain_growth = retrain_growth
+        self.max_per_label = max_per_label
+        # Read-only copies (worker processes) predict and reload, but never learn or save
+        self.read_only = read_only
+        self.examples: Dict[str, Tuple[str, float]] = {}
+        self.pipeline = None
+        self.version = 0
+        self.trained_on = 0
+        self.pending = 0
+        self._loaded_mtime = None
+        if self.path is not None and self.path.exists():
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self.examples)
+
+    @property
+    def trained(self) -> bool:
+        return self.pipeline is not None
+
+    def _load(self) -> None:
+        import joblib
+
+        state = joblib.load(self.path)
+        self.pipeline = state["pipeline"]
+        self.version = state["version"]
+        self.trained_on = state["trained_on"]
+        if not self.read_only:
+            self.examples = state["examples"]
+        self._loaded_mtime = self.path.stat().st_mtime_ns
+
+    def save(self) -> None:
+        if self.path is None or self.read_only:
+            return
+        import joblib
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        state = {"pipeline": self.pipeline, "version": self.version,
+                 "trained_on": self.trained_on, "examples": self.examples}
+        joblib.dump(state, tmp)
+        # Readers in other processes never see a half-written file
+        os.replace(tmp, self.path)
+        self._loaded_mtime = self.path.stat().st_mtime_ns
+
+    def refresh(self) -> None:
+        """Read-only copies: reload the model if the learning process saved a newer one."""
+        if not self.read_only or self.path is None or not self.path.exists():
+            return
+        if self.path.stat().st_mtime_ns != self._loaded_mtime:
+            self._load()
+
+    def snapshot(self) -> "LinearTier":
+        """Read-only copy without the training examples, cheap to send to worker processes."""
+        copy = LinearTier.__new__(LinearTier)
+        copy.__dict__.update(self.__dict__, examples={}, read_only=True)
+        return copy
+
+    def learn(self, texts: Sequence[str], labels: Sequence[Sequence[Optional[str]]],
+              weight: float = 1.0, force: bool = False) -> bool:
+        """Add labeled narrations; refits when enough have changed, or on any change with ``force``.
+
+        Returns True if a new model was fitted.
+        """
+        if self.read_only:
+            return False
+        touched = set()
+        for text, label in zip(texts, labels):
+            if not text or not label[0]:
+                continue
+            example = (_encode_label(label), weight)
+            current = self.examples.get(text)
+            if current == example:
+                # Seen again: moves to the back of the eviction order
+                self.examples[text] = self.examples.pop(text)
+            # A rule hit never overrides a heavier correction for the same narration
+            elif current is None or weight >= current[1]:
+                self.examples.pop(text, None)
+                self.examples[text] = example
+                self.pending += 1
+                touched.add(example[0])
+        if touched:
+            self._evict(touched)
+        if self.pending and len(self.examples) >= self.min_examples \
+                and (force or self.pending >= self.retrain_growth * self.trained_on):
+            return self.fit()
+        return False
+
+    def _evict(self, labels: set) -> None:
+        # The examples dict is in least-recently-seen order; the heaviest and the most
+        # recent examples of each over-full label are kept
+        by_label = defaultdict(list)
+        for text, (label, _) in self.examples.items():
+            if label in labels:
+                by_label[label].append(text)
+        for texts in by_label.values():
+            if len(texts) > self.max_per_label:
+                ranked = sorted(range(len(texts)), key=lambda i: (self.examples[texts[i]][1], i), reverse=True)
+                for i in ranked[self.max_per_label:]:
+                    del self.examples[texts[i]]
+
+    @timed("linear_fit", rows=lambda self: len(self.examples))
+    def fit(self) -> bool:
+        texts = list(self.examples)
+        labels = [self.examples[t][0] for t in texts]
+        weights = np.array([self.examples[t][1] for t in texts])
+        if len(set(labels)) < 2:
+            return False
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.pipeline import make_pipeline
+
+        pipeline = make_pipeline(
+            TfidfVectorizer(analyzer="char_wb", ngram_range=NGRAM_RANGE, sublinear_tf=True, dtype=np.float32),
+            LogisticRegression(C=10.0, max_iter=300),
+        )
+        pipeline.fit(texts, labels, logisticregression__sample_weight=weights)
+        self.pipeline = pipeline
+        self.version += 1
+        self.trained_on = len(texts)
+        self.pending = 0
+        self.save()
+        return True
+
+    @timed("linear_classify", rows=lambda self, texts: len(texts))
+    def predict(self, texts: Sequence[str]) -> Tuple[List[Optional[LinearLabel]], np.ndarray]:
+        """Best label and its probability per narration; (None, nan) everywhere before the first fit."""
+        if self.pipeline is None or not len(texts):
+            return [None] * len(texts), np.full(len(texts), np.nan, dtype=np.float32)
+        proba = self.pipeline.predict_proba(list(texts))
+        best = proba.argmax(axis=1)
+        classes = self.pipeline.classes_
+        return [_decode_label(classes[i]) for i in best], proba[np.arange(len(best)), best].astype(np.float32)
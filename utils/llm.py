@@ -0,0 +1,269 @@
+import asyncio
+import hashlib
+import json
+import os
+import pathlib
+import re
+import sqlite3
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import httpx
+except ImportError:  # optional: only the LLM tier needs it
+    httpx = None
+
+from utils.embedding_cache import CACHE_ROOT
+
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com"
+DEFAULT_LLM_MODEL = "gemini-1.5-pro-latest"
+LLM_CACHE_PATH = CACHE_ROOT / "llm_responses.sqlite"
+
+LLM_BATCH_SIZE = 25
+LLM_MAX_CONCURRENCY = 4
+LLM_REQUESTS_PER_MINUTE = 60
+LLM_TIMEOUT = 30.0
+LLM_RETRIES = 2
+LLM_BACKOFF = 0.5
+# Consecutive failed requests that open the circuit, and how long it then stays open
+LLM_MAX_FAILURES = 3
+LLM_COOLDOWN = 60.0
+# Used when the model leaves out the confidence
+DEFAULT_LLM_CONFIDENCE = 0.85
+# Default LabelSettings.llm_confidence: MiniLM labels with a lower similarity are sent
+# to the LLM, and LLM answers need at least this confidence to replace them
+LLM_MIN_CONFIDENCE = 0.6
+
+# (category, tag_1, tag_2, tag_3, confidence)
+LLMResult = Tuple[str, Optional[str], Optional[str], Optional[str], float]
+
+
+def normalize_description(text: Optional[str]) -> str:
+    return re.sub(r"\s+", " ", (text or "").lower()).strip()
+
+
+def build_prompt(descriptions: Sequence[str], categories: Sequence[str]) -> str:
+    lines = [
+        "You are a finance assistant. Classify each bank transaction below into exactly one of "
+        "the categories, add up to three short tags describing it, and give your confidence "
+        "between 0 and 1.",
+        f"Categories: {json.dumps(list(categories))}",
+        "Respond strictly with a JSON array holding one object per transaction, with keys: "
+        "id, category, tag1, tag2, tag3, confidence. Use null for tags that do not apply.",
+        "",
+        "Transactions:",
+    ]
+    lines.extend(f"{i}. {d}" for i, d in enumerate(descriptions, start=1))
+    return "\n".join(lines)
+
+
+def parse_answers(text: str, n: int, categories: Sequence[str]) -> List[Optional[LLMResult]]:
+    """Map a JSON-array reply back to the ``n`` prompted rows; unusable entries are None."""
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text.strip())
+    try:
+        items = json.loads(text)
+    except json.JSONDecodeError:
+        return [None] * n
+    if not isinstance(items, list):
+        return [None] * n
+
+    allowed = set(categories)
+    results: List[Optional[LLMResult]] = [None] * n
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        try:
+            idx = int(item.get("id")) - 1
+            confidence = float(item.get("confidence", DEFAULT_LLM_CONFIDENCE))
+        except (TypeError, ValueError):
+            continue
+        category = item.get("category")
+        tags = (item.get("tag1"), item.get("tag2"), item.get("tag3"))
+        # Lists or objects in place of strings would break the set lookup and the ledger insert
+        if not isinstance(category, str) or not all(tag is None or isinstance(tag, str) for tag in tags):
+            continue
+        if 0 <= idx < n and category in allowed:
+            results[idx] = (category,) + tags + (confidence,)
+    return results
+
+
+class LLMResponseCache:
+    """SQLite store of parsed LLM answers, keyed by model, categories and normalized description."""
+
+    def __init__(self, path=LLM_CACHE_PATH):
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with sqlite3.connect(self.path) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, result TEXT NOT NULL)")
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, LLMResult]:
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        with sqlite3.connect(self.path) as conn:
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT key, result FROM responses WHERE key IN ({','.join('?' * len(chunk))})", chunk,
+                )
+                found.update((key, tuple(json.loads(result))) for key, result in rows)
+        return found
+
+    def put_many(self, results: Dict[str, LLMResult]) -> None:
+        if not results:
+            return
+        with sqlite3.connect(self.path, timeout=30) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO responses (key, result) VALUES (?, ?)",
+                [(key, json.dumps(result)) for key, result in results.items()],
+            )
+
+
+class RateLimiter:
+    """Spaces request starts at least ``60 / per_minute`` seconds apart."""
+
+    def __init__(self, per_minute: Optional[float]):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class LLMClassifier:
+    """Batched, concurrent Gemini classification of narrations the local tiers could not label.
+
+    Narrations are packed ``batch_size`` to a prompt and sent concurrently
+    (at most ``max_concurrency`` in flight, ``requests_per_minute`` overall)
+    through the generateContent REST endpoint. Failed requests are retried
+    with backoff; after ``max_failures`` consecutive failures the circuit
+    opens and batches are skipped for ``cooldown`` seconds. Parsed answers
+    are cached on disk, so a narration is only ever sent once per model and
+    category list.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, model: str = DEFAULT_LLM_MODEL,
+                 base_url: Optional[str] = None, batch_size: int = LLM_BATCH_SIZE,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 requests_per_minute: Optional[float] = LLM_REQUESTS_PER_MINUTE,
+                 timeout: float = LLM_TIMEOUT, retries: int = LLM_RETRIES,
+                 max_failures: int = LLM_MAX_FAILURES, cooldown: float = LLM_COOLDOWN,
+                 cache_path=LLM_CACHE_PATH):
+        if httpx is None:
+            raise ImportError("the LLM tier requires the httpx package")
+        self.api_key = api_key or os.getenv("GEMINI_API_KEY")
+        self.model = model
+        self.base_url = (base_url or os.getenv("GEMINI_BASE_URL") or GEMINI_BASE_URL).rstrip("/")
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.timeout = timeout
+        self.retries = retries
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.cache = LLMResponseCache(cache_path) if cache_path is not None else None
+        self.stats: Counter = Counter()
+        self.failures = 0
+        self._opened_at: Optional[float] = None
+
+    @property
+    def circuit_open(self) -> bool:
+        if self._opened_at is None:
+            return False
+        if time.monotonic() - self._opened_at >= self.cooldown:
+            # Half-open: one more failure re-opens the circuit straight away
+            self._opened_at = None
+            self.failures = self.max_failures - 1
+            return False
+        return True
+
+    def _record_failure(self) -> None:
+        self.failures += 1
+        self.stats["failed_requests"] += 1
+        if self.failures >= self.max_failures and self._opened_at is None:
+            self._opened_at = time.monotonic()
+
+    def _cache_key(self, description: str, categories: Sequence[str]) -> str:
+        payload = json.dumps([self.model, sorted(categories), normalize_description(description)])
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def classify_many(self, descriptions: Sequence[str], categories: Sequence[str]) -> List[Optional[LLMResult]]:
+        """Blocking wrapper around ``aclassify_many``; None where no usable answer came back."""
+        return asyncio.run(self.aclassify_many(descriptions, categories))
+
+    async def aclassify_many(self, descriptions: Sequence[str], categories: Sequence[str]) -> List[Optional[LLMResult]]:
+        keys = [self._cache_key(d, categories) for d in descriptions]
+        answers: Dict[str, LLMResult] = self.cache.get_many(keys) if self.cache is not None else {}
+        self.stats["cached"] += sum(key in answers for key in keys)
+
+        # One prompt slot per distinct narration not answered before
+        pending = {}
+        for key, description in zip(keys, descriptions):
+            if key not in answers and key not in pending:
+                pending[key] = description
+        pending_keys = list(pending)
+        batches = [pending_keys[i:i + self.batch_size] for i in range(0, len(pending_keys), self.batch_size)]
+
+        if batches:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            limiter = RateLimiter(self.requests_per_minute)
+            async with httpx.AsyncClient(timeout=self.timeout) as client:
+                replies = await asyncio.gather(*(
+                    self._classify_batch(client, semaphore, limiter, [pending[k] for k in batch], categories)
+                    for batch in batches
+                ))
+            fresh = {
+                key: result
+                for batch, reply in zip(batches, replies)
+                for key, result in zip(batch, reply)
+                if result is not None
+            }
+            if self.cache is not None:
+                self.cache.put_many(fresh)
+            answers.update(fresh)
+        return [answers.get(key) for key in keys]
+
+    async def _classify_batch(self, client, semaphore: asyncio.Semaphore, limiter: RateLimiter,
+                              descriptions: List[str], categories: Sequence[str]) -> List[Optional[LLMResult]]:
+        url = f"{self.base_url}/v1beta/models/{self.model}:generateContent"
+        payload = {
+            "contents": [{"parts": [{"text": build_prompt(descriptions, categories)}]}],
+            "generationConfig": {
+                "temperature": 0.0,
+                "topP": 1,
+                "maxOutputTokens": 80 * len(descriptions),
+                "responseMimeType": "application/json",
+            },
+        }
+        async with semaphore:
+            for attempt in range(self.retries + 1):
+                if self.circuit_open:
+                    self.stats["skipped_batches"] += 1
+                    return [None] * len(descriptions)
+                await limiter.wait()
+                self.stats["requests"] += 1
+                try:
+                    response = await client.post(url, json=payload, headers={"x-goog-api-key": self.api_key or ""})
+                    retryable = response.status_code == 429 or response.status_code >= 500
+                    if not retryable:
+                        response.raise_for_status()
+                        self.failures = 0
+                        text = response.json()["candidates"][0]["content"]["parts"][0]["text"]
+                        return parse_answers(text, len(descriptions), categories)
+                except (httpx.TimeoutException, httpx.TransportError):
+                    pass
+                except (httpx.HTTPStatusError, KeyError, IndexError, TypeError, ValueError):
+                    # Bad request or malformed reply: retrying the same prompt will not help
+                    break
+                if attempt < self.retries:
+                    await asyncio.sleep(LLM_BACKOFF * 2 ** attempt)
+            self._record_failure()
+            return [None] * len(descriptions)
@@ -0,0 +1,134 @@
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Match tiers, in priority order
+EXACT, ALL_WORDS, ANY_WORD = 0, 1, 2
+
+# Words this short are ignored by the all-words tier (but not the any-word tier)
+MIN_WORD_LEN = 3
+
+
+class MerchantMatcher:
+    """Aho-Corasick automaton over every merchant key and key word.
+
+    One scan of a preprocessed description finds all exact, all-words and
+    any-word merchant hits; the earliest merchant in catalog order wins
+    within a tier, and a lower tier always beats a higher one.
+    """
+
+    def __init__(self, merchant_keys: Iterable[str]):
+        self.merchant_keys = [key.lower() for key in merchant_keys]
+
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+        self._patterns: Dict[str, int] = {}
+
+        # Per pattern: lowest merchant index for the exact / any-word tiers
+        self._exact_min: List[int] = []
+        self._any_min: List[int] = []
+        # Per pattern: merchants that list it as a required (long) word
+        self._required_by: List[List[int]] = []
+        self._required_count: List[int] = []
+        self._always_all_words: Optional[int] = None
+
+        none = len(self.merchant_keys)
+        for m_idx, key in enumerate(self.merchant_keys):
+            if not key:
+                self._required_count.append(0)
+                continue
+            p = self._add_pattern(key, none)
+            self._exact_min[p] = min(self._exact_min[p], m_idx)
+
+            words = key.split()
+            for word in set(words):
+                p = self._add_pattern(word, none)
+                self._any_min[p] = min(self._any_min[p], m_idx)
+
+            required = {w for w in words if len(w) >= MIN_WORD_LEN}
+            for word in required:
+                self._required_by[self._patterns[word]].append(m_idx)
+            self._required_count.append(len(required))
+            if not required and self._always_all_words is None:
+                # all() over no words is True: this key matches any text
+                self._always_all_words = m_idx
+
+        self._build_failure_links()
+
+    def _add_pattern(self, pattern: str, none: int) -> int:
+        if pattern in self._patterns:
+            return self._patterns[pattern]
+        p = len(self._patterns)
+        self._patterns[pattern] = p
+        self._exact_min.append(none)
+        self._any_min.append(none)
+        self._required_by.append([])
+
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append(p)
+        return p
+
+    def _build_failure_links(self) -> None:
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for ch, nxt in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+                queue.append(nxt)
+
+    def _scan(self, text: str) -> set:
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+    def match(self, text: str) -> Optional[Tuple[int, int]]:
+        """Return ``(tier, merchant_index)`` for the best hit, or ``None``."""
+        none = len(self.merchant_keys)
+        found = self._scan(text) if text else set()
+
+        exact = min((self._exact_min[p] for p in found), default=none)
+        if exact < none:
+            return EXACT, exact
+
+        hits: Dict[int, int] = {}
+        for p in found:
+            for m_idx in self._required_by[p]:
+                hits[m_idx] = hits.get(m_idx, 0) + 1
+        complete = [m for m, n in hits.items() if n == self._required_count[m]]
+        if self._always_all_words is not None:
+            complete.append(self._always_all_words)
+        if complete:
+            return ALL_WORDS, min(complete)
+
+        any_word = min((self._any_min[p] for p in found), default=none)
+        if any_word < none:
+            return ANY_WORD, any_word
+        return None
+
+    def match_many(self, texts: Sequence[str]) -> List[Optional[Tuple[int, int]]]:
+        """Match a whole column, scanning each distinct text only once."""
+        seen: Dict[str, Optional[Tuple[int, int]]] = {}
+        results = []
+        for text in texts:
+            if text not in seen:
+                seen[text] = self.match(text)
+            results.append(seen[text])
+        return results
@@ -1,7 +1,21 @@
 import re
+import numpy as np
 import pandas as pd
 
+from utils.instrument import timed
+
 REQUIRED_COLUMNS = ["Date", "Narration", "Ref/Cheque No.", "Debit", "Credit", "Balance"]
+# Two rows are duplicates when all of these match after cleaning
+DEDUP_COLUMNS = ["Date", "Narration", "Ref/Cheque No.", "Debit", "Credit", "Balance"]
+AMOUNT_COLUMNS = ["Debit", "Credit", "Balance"]
+# Columns where a "Dr" suffix means the amount is negative (an overdrawn balance)
+DR_NEGATIVE_COLUMNS = {"Balance"}
+
+# Case-insensitive inline, since Arrow-backed string columns reject the flags argument
+AMOUNT_PATTERN = (
+    r"(?i)^(?P<paren>\()?\s*(?P<sign>[-+])?\s*(?:₹|rs\.?|inr)?\s*"
+    r"(?P<num>\d[\d,]*(?:\.\d*)?|\.\d+)\s*\)?\s*(?P<side>dr|cr)?\.?$"
+)
 
 
 def _clean_description(desc: str) -> str:
@@ -12,8 +26,64 @@ def _clean_description(desc: str) -> str:
     desc = re.sub(r"[#_*]", " ", desc)
     return desc
 
+def _as_text(series: pd.Series) -> pd.Series:
+    # Keeps Arrow/"string" dtypes as they are so the .str ops below stay vectorized
+    if series.dtype == object or not pd.api.types.is_string_dtype(series.dtype):
+        series = series.astype(object).where(series.notna(), None).astype("string")
+    return series.fillna("")
+
+
+def _clean_text(series: pd.Series) -> pd.Series:
+    """Column-wide equivalent of _clean_description."""
+    return (
+        _as_text(series)
+        .str.strip()
+        .str.replace(r"\s+", " ", regex=True)
+        .str.replace(r"[#_*]", " ", regex=True)
+    )
+
+
+def _parse_amounts(df: pd.DataFrame, columns) -> None:
+    """Parse every amount column to float in one pass over the stacked text values.
+
+    Handles thousands / lakh separators, currency prefixes, leading signs,
+    parentheses for negatives and Dr/Cr suffixes ("Dr" makes a balance negative).
+    Blank and "-" cells are zero; missing or unparseable cells become NaN.
+    """
+    text_cols = [c for c in columns if not pd.api.types.is_numeric_dtype(df[c])]
+    for col in columns:
+        if col not in text_cols:
+            df[col] = df[col].astype(float)
+    if not text_cols:
+        return
+
+    n = len(df)
+    stacked = pd.concat([df[c] for c in text_cols], ignore_index=True)
+    text = _as_text(stacked).str.strip()
+    parts = text.str.extract(AMOUNT_PATTERN)
+
+    values = pd.to_numeric(parts["num"].str.replace(",", "", regex=False), errors="coerce")
+    values = values.to_numpy(dtype=float, na_value=np.nan, copy=True)
+    blank = text.isin(["", "-"]) & stacked.notna()
+    values[blank.to_numpy(dtype=bool, na_value=False)] = 0.0
+
+    minus = parts["sign"].eq("-").to_numpy(dtype=bool, na_value=False)
+    # Compared rather than notna(): ArrowDtype extracts give "" for groups that did not match
+    paren = parts["paren"].eq("(").to_numpy(dtype=bool, na_value=False)
+    debit_suffix = parts["side"].str.lower().eq("dr").to_numpy(dtype=bool, na_value=False)
+    signed_cols = np.repeat([c in DR_NEGATIVE_COLUMNS for c in text_cols], n)
+    negative = minus | paren | (debit_suffix & signed_cols)
+    values[negative] = -values[negative]
+
+    for col, col_values in zip(text_cols, values.reshape(len(text_cols), n)):
+        df[col] = col_values
+
+
+@timed("clean_dataframe", rows=lambda df: len(df))
 def clean_dataframe(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
+    # Every column touched below is replaced rather than written into, so the
+    # caller's frame stays intact without a deep copy
+    df = df.copy(deep=False)
 
     # Ensure required columns exist
     for col in REQUIRED_COLUMNS:
@@ -21,23 +91,12 @@ def clean_dataframe(df: pd.DataFrame) -> pd.DataFrame:
             df[col] = None
 
     # Coerce types
-    df["Narration"] = df["Narration"].astype(str).apply(_clean_description)
-    df["Ref/Cheque No."] = df["Ref/Cheque No."].astype(str).apply(_clean_description)
-    df["Debit"] = df["Debit"].astype(str).str.replace(",", "").replace("", "0").replace("-", "0").astype(float)
-    df["Credit"] = df["Credit"].astype(str).str.replace(",", "").replace("", "0").replace("-", "0").astype(float)
-    df["Balance"] = df["Balance"].astype(str).str.replace(",", "").replace("", "0").replace("-", "0").astype(float)
+    df["Narration"] = _clean_text(df["Narration"])
+    df["Ref/Cheque No."] = _clean_text(df["Ref/Cheque No."])
+    _parse_amounts(df, AMOUNT_COLUMNS)
 
     # Basic de-dup
-    df.drop_duplicates(subset=["Date", "Narration", "Ref/Cheque No.", "Debit", "Credit", "Balance"], inplace=True)
+    df.drop_duplicates(subset=DEDUP_COLUMNS, inplace=True)
     df.reset_index(drop=True, inplace=True)
 
     return df
-
-
-
-
-
-
-
-
-
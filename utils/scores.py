@@ -0,0 +1,244 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+MAX_TAGS = 3
+TAG_THRESHOLD = 0.4
+
+
+@dataclass(frozen=True)
+class LabelSettings:
+    """User-tunable acceptance rules applied on top of cached scores.
+
+    ``None`` fields fall back to the categorizer's defaults.
+    """
+
+    allowed_categories: Optional[Tuple[str, ...]] = None
+    low_confidence_label: Optional[str] = None
+    rule_confidence: Optional[float] = None
+    # Rule confidences, exemplar vote shares and prototype similarities below this go to the
+    # low-confidence label; off by default
+    min_confidence: Optional[float] = None
+    use_model: bool = True
+    # Only has an effect when the categorizer was given a linear tier; None uses its default cutoff
+    use_linear: bool = True
+    linear_confidence: Optional[float] = None
+    # Only has an effect when the categorizer was given an LLM client. MiniLM prototype
+    # labels below llm_confidence are sent to it, and its answers need at least that much
+    use_llm: bool = True
+    llm_confidence: Optional[float] = None
+
+
+def top_tags(tag_sims: np.ndarray, vocabulary: Sequence[str], max_tags: int = MAX_TAGS,
+             threshold: float = TAG_THRESHOLD) -> List[List[Optional[str]]]:
+    """Vectorized top-k over a (rows x tags) similarity matrix, padded with None."""
+    k = min(max_tags, tag_sims.shape[1])
+    if k == 0 or tag_sims.shape[0] == 0:
+        return [[None] * max_tags for _ in range(tag_sims.shape[0])]
+    top = np.argpartition(-tag_sims, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(tag_sims, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    top = np.take_along_axis(top, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+    tags = []
+    for idx_row, score_row in zip(top, top_scores):
+        row = [vocabulary[i] for i, sc in zip(idx_row, score_row) if sc >= threshold]
+        tags.append((row + [None] * max_tags)[:max_tags])
+    return tags
+
+
+class ScoreMatrix:
+    """Everything needed to label a narration, cached per distinct narration.
+
+    Holds the rule match (category, tier, tags), the person-transfer check,
+    the linear tier's prediction, and, once a row has been encoded, its
+    similarity to every category and tag prototype plus its exemplar vote. Changing ``LabelSettings`` is then
+    a vectorized re-selection; only rows that newly need embeddings (e.g. a
+    rule match whose category was just disallowed) are encoded.
+    """
+
+    def __init__(self, categories: Sequence[str], tag_vocabulary: Sequence[str],
+                 tier_factors: Sequence[float]):
+        self.categories = list(categories)
+        self.tag_vocabulary = list(tag_vocabulary)
+        self.tier_factors = np.asarray(tier_factors, dtype=np.float64)
+        self.rows: Dict[str, int] = {}
+        self.descriptions: List[str] = []
+
+        self.rule_category = np.empty(0, dtype=object)
+        self.rule_tier = np.empty(0, dtype=np.int8)
+        self.rule_tags = np.empty((0, 3), dtype=object)
+        # None: not a person transfer, "": send to the fallback label, else the category
+        self.person = np.empty(0, dtype=object)
+        # Linear tier label and probability; NaN until predicted
+        self.linear_category = np.empty(0, dtype=object)
+        self.linear_tags = np.empty((0, 3), dtype=object)
+        self.linear_confidence = np.empty(0, dtype=np.float32)
+
+        self.scored = np.empty(0, dtype=bool)
+        self.category_sims = np.empty((0, len(self.categories)), dtype=np.float32)
+        self.tag_sims = np.empty((0, len(self.tag_vocabulary)), dtype=np.float32)
+        self.exemplar_label = np.empty(0, dtype=object)
+        self.exemplar_share = np.empty(0, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.descriptions)
+
+    def lookup(self, descriptions: Sequence[str]) -> np.ndarray:
+        """Row per description, -1 for descriptions not cached yet."""
+        return np.fromiter((self.rows.get(d, -1) for d in descriptions), dtype=np.int64, count=len(descriptions))
+
+    def add(self, descriptions: Sequence[str], rule_hits, persons: Sequence[Optional[str]]) -> np.ndarray:
+        """Append new rows. ``rule_hits`` holds ``(category, tier, tags)``, tier -1 for no match."""
+        start = len(self.descriptions)
+        n = len(descriptions)
+        for i, d in enumerate(descriptions):
+            self.rows[d] = start + i
+        self.descriptions.extend(descriptions)
+
+        self.rule_category = np.concatenate([self.rule_category, np.array([h[0] for h in rule_hits] + [None], dtype=object)[:n]])
+        self.rule_tier = np.concatenate([self.rule_tier, np.array([h[1] for h in rule_hits], dtype=np.int8)])
+        tags = np.empty((n, 3), dtype=object)
+        for i, h in enumerate(rule_hits):
+            tags[i] = h[2]
+        self.rule_tags = np.concatenate([self.rule_tags, tags])
+        self.person = np.concatenate([self.person, np.array(list(persons) + [None], dtype=object)[:n]])
+        self.linear_category = np.concatenate([self.linear_category, np.full(n, None, dtype=object)])
+        self.linear_tags = np.concatenate([self.linear_tags, np.full((n, 3), None, dtype=object)])
+        self.linear_confidence = np.concatenate([self.linear_confidence, np.full(n, np.nan, dtype=np.float32)])
+
+        self.scored = np.concatenate([self.scored, np.zeros(n, dtype=bool)])
+        self.category_sims = np.concatenate([self.category_sims, np.zeros((n, len(self.categories)), dtype=np.float32)])
+        self.tag_sims = np.concatenate([self.tag_sims, np.zeros((n, len(self.tag_vocabulary)), dtype=np.float32)])
+        self.exemplar_label = np.concatenate([self.exemplar_label, np.full(n, None, dtype=object)])
+        self.exemplar_share = np.concatenate([self.exemplar_share, np.zeros(n, dtype=np.float32)])
+        return np.arange(start, start + n)
+
+    def set_scores(self, rows: np.ndarray, category_sims: np.ndarray, tag_sims: np.ndarray,
+                   exemplar_votes: Sequence[Tuple[Optional[str], float]]) -> None:
+        self.category_sims[rows] = category_sims
+        self.tag_sims[rows] = tag_sims
+        self.exemplar_label[rows] = np.array([v[0] for v in exemplar_votes] + [None], dtype=object)[:len(rows)]
+        self.exemplar_share[rows] = [v[1] for v in exemplar_votes]
+        self.scored[rows] = True
+
+    def set_linear(self, rows: np.ndarray, labels: Sequence[Optional[Tuple]], confidence: np.ndarray) -> None:
+        for row, label in zip(rows, labels):
+            if label is not None:
+                self.linear_category[row] = label[0]
+                self.linear_tags[row] = label[1:4]
+        self.linear_confidence[rows] = confidence
+
+    def invalidate_linear(self) -> None:
+        """Force rows to be re-predicted, e.g. after the linear model was refitted."""
+        self.linear_category[:] = None
+        self.linear_tags[:] = None
+        self.linear_confidence[:] = np.nan
+
+    def invalidate_scores(self) -> None:
+        """Force rows to be re-scored, e.g. after the exemplar index changed."""
+        self.scored[:] = False
+
+    def _allowed(self, labels: np.ndarray, settings: LabelSettings) -> np.ndarray:
+        present = np.not_equal(labels, None)
+        if settings.allowed_categories is None:
+            return present
+        return present & np.isin(labels.astype(str), list(settings.allowed_categories))
+
+    def _rule_accepted(self, rows: np.ndarray, settings: LabelSettings) -> np.ndarray:
+        tiers = self.rule_tier[rows]
+        confidence = settings.rule_confidence * self.tier_factors[np.maximum(tiers, 0)]
+        return (tiers >= 0) & self._allowed(self.rule_category[rows], settings) & (confidence >= settings.min_confidence)
+
+    def _linear_accepted(self, rows: np.ndarray, settings: LabelSettings) -> np.ndarray:
+        if not settings.use_linear:
+            return np.zeros(len(rows), dtype=bool)
+        confidence = self.linear_confidence[rows]
+        # NaN (not predicted) compares False
+        return (
+            (confidence >= settings.linear_confidence) & (confidence >= settings.min_confidence)
+            & self._allowed(self.linear_category[rows], settings)
+        )
+
+    def needs_linear(self, rows: np.ndarray, settings: LabelSettings) -> np.ndarray:
+        """Rows the rules and person checks leave unlabeled that have no linear prediction yet."""
+        if not settings.use_linear:
+            return rows[:0]
+        pending = (
+            ~self._rule_accepted(rows, settings) & np.equal(self.person[rows], None)
+            & np.isnan(self.linear_confidence[rows])
+        )
+        return np.unique(rows[pending])
+
+    def needs_scores(self, rows: np.ndarray, settings: LabelSettings) -> np.ndarray:
+        """Rows that fall through to the embedding tiers and have no scores yet."""
+        if not settings.use_model:
+            return rows[:0]
+        pending = (
+            ~self._rule_accepted(rows, settings) & np.equal(self.person[rows], None)
+            & ~self._linear_accepted(rows, settings) & ~self.scored[rows]
+        )
+        return np.unique(rows[pending])
+
+    def select(self, rows: np.ndarray, settings: LabelSettings, with_similarity: bool = False):
+        """(Category, Tag_1, Tag_2, Tag_3, Method) per row under ``settings``.
+
+        With ``with_similarity``, also returns the prototype similarity behind each
+        MiniLM label (NaN for rows labeled any other way).
+        """
+        n = len(rows)
+        fallback = settings.low_confidence_label
+        category = np.full(n, fallback, dtype=object)
+        tags = np.full((n, 3), None, dtype=object)
+        method = np.full(n, "Fallback", dtype=object)
+        similarity = np.full(n, np.nan, dtype=np.float32)
+
+        rule_ok = self._rule_accepted(rows, settings)
+        category[rule_ok] = self.rule_category[rows[rule_ok]]
+        tags[rule_ok] = self.rule_tags[rows[rule_ok]]
+        method[rule_ok] = "Rule Engine"
+
+        person = self.person[rows]
+        is_person = ~rule_ok & np.not_equal(person, None)
+        person_ok = is_person & np.not_equal(person, "") & self._allowed(person, settings)
+        category[person_ok] = person[person_ok]
+        method[person_ok] = "MiniLM Fallback"
+
+        linear_ok = ~rule_ok & ~is_person & self._linear_accepted(rows, settings)
+        category[linear_ok] = self.linear_category[rows[linear_ok]]
+        tags[linear_ok] = self.linear_tags[rows[linear_ok]]
+        method[linear_ok] = "Linear Model"
+
+        model_rows = ~rule_ok & ~is_person & ~linear_ok & self.scored[rows]
+        if settings.use_model and model_rows.any():
+            sub = rows[model_rows]
+            sub_tags = np.array(top_tags(self.tag_sims[sub], self.tag_vocabulary), dtype=object).reshape(-1, 3)
+
+            knn_ok = self._allowed(self.exemplar_label[sub], settings) & (self.exemplar_share[sub] >= settings.min_confidence)
+            sims = self.category_sims[sub]
+            if settings.allowed_categories is not None:
+                allowed_cols = np.isin(self.categories, list(settings.allowed_categories))
+                sims = np.where(allowed_cols, sims, -np.inf)
+            best = sims.argmax(axis=1)
+            best_score = sims[np.arange(len(sub)), best]
+            proto_ok = ~knn_ok & (best_score >= settings.min_confidence) & np.isfinite(best_score)
+
+            sub_category = np.full(len(sub), fallback, dtype=object)
+            sub_method = np.full(len(sub), "Fallback", dtype=object)
+            sub_category[knn_ok] = self.exemplar_label[sub[knn_ok]]
+            sub_method[knn_ok] = "Exemplar k-NN"
+            sub_category[proto_ok] = np.asarray(self.categories, dtype=object)[best[proto_ok]]
+            sub_method[proto_ok] = "MiniLM Fallback"
+            sub_tags[~(knn_ok | proto_ok)] = None
+
+            category[model_rows] = sub_category
+            method[model_rows] = sub_method
+            tags[model_rows] = sub_tags
+            similarity[model_rows] = np.where(proto_ok, best_score, np.nan)
+
+        labels = [
+            (c, t[0], t[1], t[2], m)
+            for c, t, m in zip(category.tolist(), tags.tolist(), method.tolist())
+        ]
+        return (labels, similarity) if with_similarity else labels
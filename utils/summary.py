@@ -0,0 +1,125 @@
+import hashlib
+from typing import Optional
+
+import pandas as pd
+
+from utils.instrument import timed
+
+
+@timed("spend_by_category", rows=lambda df_out, *args, **kwargs: len(df_out))
+def spend_by_category(df_out: pd.DataFrame, fill_label: str = "Uncategorized") -> pd.Series:
+    """Total debit spend per category, largest first. Empty when there are no debits."""
+    debit = pd.to_numeric(df_out["Debit"], errors="coerce").fillna(0)
+
+    # Only consider rows where Debit > 0
+    mask = debit > 0
+    categories = df_out.loc[mask, "Category"].astype(object).fillna(fill_label)
+
+    return (
+        debit[mask]
+        .groupby(categories)
+        .sum()
+        .abs()
+        .sort_values(ascending=False)
+    )
+
+
+def series_hash(series: pd.Series) -> str:
+    """Content hash of a small summary series, rounded to paise."""
+    return hashlib.sha1(series.round(2).to_json().encode("utf-8")).hexdigest()[:16]
+
+
+class SpendAggregator:
+    """Running debit totals per (day, category), updated as rows are categorized.
+
+    ``add`` and ``subtract`` only group the rows they are given, so a
+    relabel touching a few rows never rescans the frame. Rows with an
+    unparseable date count towards the category totals but not the time
+    rollups; ``unparsed_dates`` says how many there are.
+
+    ``dayfirst`` fixes how dates like 05/03/2024 are read. Left as None,
+    dates are read month-first unless day-first parses more of them (as
+    with 25/03/2024), and that order is then kept for later rows.
+    """
+
+    def __init__(self, fill_label: str = "Uncategorized", dayfirst: Optional[bool] = None):
+        self.fill_label = fill_label
+        self.dayfirst = dayfirst
+        # Debit sum and row count per (Day, Category); NaT days are kept as their own key
+        self._totals = pd.DataFrame(
+            {"Debit": pd.Series(dtype=float), "rows": pd.Series(dtype="int64")},
+            index=pd.MultiIndex.from_arrays(
+                [pd.DatetimeIndex([]), pd.Index([], dtype=object)], names=["Day", "Category"],
+            ),
+        )
+
+    def __len__(self) -> int:
+        return int(self._totals["rows"].sum())
+
+    def unparsed_dates(self) -> int:
+        """Debit rows whose date could not be parsed, left out of ``by_period``."""
+        undated = self._totals.index.get_level_values("Day").isna()
+        return int(self._totals.loc[undated, "rows"].sum())
+
+    def _parse_dates(self, dates: pd.Series) -> pd.Series:
+        if self.dayfirst is not None:
+            return pd.to_datetime(dates, errors="coerce", dayfirst=self.dayfirst)
+        parsed = pd.to_datetime(dates, errors="coerce")
+        if parsed.isna().any():
+            # The format is inferred from the first date, so 25/03/2024 fails after 05/03/2024
+            swapped = pd.to_datetime(dates, errors="coerce", dayfirst=True)
+            if swapped.notna().sum() > parsed.notna().sum():
+                self.dayfirst = True
+                return swapped
+        return parsed
+
+    @timed("spend_aggregate", rows=lambda self, df_out, *args, **kwargs: len(df_out))
+    def add(self, df_out: pd.DataFrame, sign: int = 1) -> "SpendAggregator":
+        debit = pd.to_numeric(df_out["Debit"], errors="coerce").fillna(0)
+        mask = (debit > 0).to_numpy()
+        if not mask.any():
+            return self
+        rows = pd.DataFrame({
+            "Day": self._parse_dates(df_out.loc[mask, "Date"]).dt.normalize(),
+            "Category": df_out.loc[mask, "Category"].astype(object).fillna(self.fill_label),
+            "Debit": debit[mask],
+            "rows": 1,
+        })
+        delta = rows.groupby(["Day", "Category"], dropna=False)[["Debit", "rows"]].sum() * sign
+        totals = self._totals.add(delta, fill_value=0)
+        # Keys whose rows were all subtracted again are dropped, along with their float residue
+        self._totals = totals[totals["rows"] != 0].astype({"rows": "int64"})
+        return self
+
+    def subtract(self, df_out: pd.DataFrame) -> "SpendAggregator":
+        return self.add(df_out, sign=-1)
+
+    def update(self, before: pd.DataFrame, after: pd.DataFrame) -> "SpendAggregator":
+        """Apply a relabel: only rows whose Category changed between the two frames are moved."""
+        changed = (
+            before["Category"].astype(object).fillna(self.fill_label)
+            != after["Category"].astype(object).fillna(self.fill_label)
+        ).to_numpy()
+        if changed.any():
+            self.subtract(before[changed])
+            self.add(after[changed])
+        return self
+
+    def by_category(self) -> pd.Series:
+        """Same result as ``spend_by_category`` on every row added so far."""
+        spend = self._totals["Debit"].groupby(level="Category").sum().abs()
+        spend.name = "Debit"
+        return spend.sort_values(ascending=False)
+
+    def by_period(self, freq: str = "M", by_category: bool = True) -> pd.DataFrame:
+        """Spend per period ("D", "W", "M", ...) with one column per category, or a single Debit column."""
+        totals = self._totals["Debit"].reset_index()
+        totals = totals[totals["Day"].notna()]
+        period = totals["Day"].dt.to_period(freq).rename("Period")
+        if not by_category:
+            return totals.groupby(period)["Debit"].sum().to_frame()
+        return totals.pivot_table(index=period, columns="Category", values="Debit",
+                                  aggfunc="sum", fill_value=0.0)
+
+    def content_hash(self) -> str:
+        return series_hash(self.by_category())
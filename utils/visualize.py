@@ -1,6 +1,20 @@
+import io
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+from utils.instrument import timed
+from utils.summary import series_hash
+
+# Rendered PNGs kept per (chart, summary content hash)
+CHART_CACHE_SIZE = 32
+_png_cache: "OrderedDict[tuple, bytes]" = OrderedDict()
+_png_lock = threading.Lock()
+
+@timed("plot_category_bar", rows=lambda series: len(series))
 def plot_category_bar(series):
     fig, ax = plt.subplots(figsize=(7, 7))
     bars = ax.bar(series.index, series.values, color="#3498db", edgecolor="black")
@@ -22,6 +36,7 @@ def plot_category_bar(series):
     return fig
     
 
+@timed("plot_category_pie", rows=lambda series: len(series))
 def plot_category_pie(series):
     fig, ax = plt.subplots(figsize=(7, 7))
     wedges, texts, autotexts = ax.pie(
@@ -39,3 +54,26 @@ def plot_category_pie(series):
     return fig
 
 
+def chart_png(plot: Callable, series, key: Optional[str] = None, dpi: int = 100) -> bytes:
+    """PNG bytes of ``plot(series)``, rendered only when the summary's content changed.
+
+    ``key`` defaults to a hash of ``series`` (e.g. pass ``SpendAggregator.content_hash()``).
+    """
+    cache_key = (plot.__name__, key or series_hash(series), dpi)
+    with _png_lock:
+        png = _png_cache.get(cache_key)
+        if png is not None:
+            _png_cache.move_to_end(cache_key)
+            return png
+
+    fig = plot(series)
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=dpi)
+    plt.close(fig)
+    png = buf.getvalue()
+
+    with _png_lock:
+        _png_cache[cache_key] = png
+        while len(_png_cache) > CHART_CACHE_SIZE:
+            _png_cache.popitem(last=False)
+    return png